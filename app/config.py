@@ -35,6 +35,11 @@ NPM_METADATA_TTL_HOURS: int = int(os.environ.get("NPM_METADATA_TTL_HOURS", "24")
 NPM_TARBALL_TTL_HOURS: int = int(os.environ.get("NPM_TARBALL_TTL_HOURS", "0"))  # Immutable artifacts
 NPM_SECURITY_TTL_HOURS: int = int(os.environ.get("NPM_SECURITY_TTL_HOURS", "6"))
 
+# Prefetch the latest version's tarball in the background after a metadata fetch
+NPM_PREFETCH_LATEST_TARBALL: bool = os.environ.get(
+    "NPM_PREFETCH_LATEST_TARBALL", "true"
+).lower() in ("1", "true", "yes")
+
 # Maven TTL settings
 MAVEN_METADATA_TTL_HOURS: int = int(os.environ.get("MAVEN_METADATA_TTL_HOURS", "24"))
 MAVEN_ARTIFACT_TTL_HOURS: int = int(os.environ.get("MAVEN_ARTIFACT_TTL_HOURS", "0"))  # Immutable artifacts
@@ -46,5 +51,13 @@ PYPI_REGISTRY: str = os.environ.get("PYPI_REGISTRY", "https://pypi.org")
 MAVEN_CENTRAL: str = os.environ.get("MAVEN_CENTRAL", "https://repo1.maven.org/maven2")
 
 # Network settings
+# Extra CA bundle (PEM) to trust for upstream TLS, e.g. a corporate proxy CA
+SSL_CA_FILE: str | None = os.environ.get("SSL_CA_FILE") or None
+# Transport for the shared upstream client: "httpx" (default) or "aiohttp"
+HTTP_BACKEND: str = os.environ.get("HTTP_BACKEND", "httpx").lower()
 REQUEST_TIMEOUT_SECONDS: int = int(os.environ.get("REQUEST_TIMEOUT_SECONDS", "30"))
+# Shared upstream connection pool
+HTTP2_ENABLED: bool = os.environ.get("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_MAX_CONNECTIONS: int = int(os.environ.get("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "100"))
 MAX_RETRIES: int = int(os.environ.get("MAX_RETRIES", "3"))
\ No newline at end of file
@@ -18,8 +18,10 @@
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app.routes import pypi_routes, maven_routes, npm_routes
 import app.config as config
+import app.utils as utils
 import logging
 from contextlib import asynccontextmanager
 
@@ -29,10 +31,12 @@ logger = logging.getLogger('uvicorn')
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info(f"CACHE_DIR => {config.CACHE_DIR}")
+    utils.get_http_client()
     yield
+    await utils.close_http_client()
     logger.info("Shutting down FastAPI app")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(pypi_routes.router)
 app.include_router(maven_routes.router)
 app.include_router(npm_routes.router)
@@ -49,8 +49,15 @@ async def maven_proxy(path: str, request: Request):
     except ValidationError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-    # Determine if this is a metadata file that should be refreshed
-    is_metadata = path.endswith(('.xml', '.pom', '.sha1', '.md5'))
+    # Determine if this is a metadata file that should be refreshed;
+    # maven-metadata.xml and all of its checksums (.sha256, .sha512, ...) change
+    filename = path.rsplit('/', 1)[-1]
+    is_metadata = (
+        path.endswith(('.xml', '.pom', '.sha1', '.md5'))
+        or filename.startswith('maven-metadata.xml')
+    )
+    # Only release artifacts never change upstream; SNAPSHOTs are republished
+    is_immutable = not is_metadata and '-SNAPSHOT' not in path
     
     # Check if we need to fetch/refresh the file
     should_fetch = False
@@ -61,12 +68,16 @@ async def maven_proxy(path: str, request: Request):
     
     if should_fetch:
         upstream_url = f"{MAVEN_UPSTREAM}/{quote(path, safe='/')}"
-        await utils.fetch_and_cache(upstream_url, local_path)
+        # force_refresh: a stale metadata file exists and must be refetched
+        await utils.fetch_and_cache(
+            upstream_url, local_path, force_refresh=True, save_validators=is_metadata
+        )
     
     # Serve the file (conditional_file_response re-validates containment before serving)
     try:
         return await utils.conditional_file_response(
-            request, local_path, "application/octet-stream"
+            request, local_path, "application/octet-stream",
+            immutable=is_immutable
         )
     except FileNotFoundError:
         raise HTTPException(status_code=404)
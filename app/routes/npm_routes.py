@@ -18,9 +18,16 @@
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Response
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Optional
 from urllib.parse import quote
 from http import HTTPMethod
+import asyncio
+import logging
+import httpx
+import orjson
 
 import app.config as config
 import app.utils as utils
@@ -34,6 +41,11 @@ from app.validators import (
 NPM_UPSTREAM = config.NPM_REGISTRY
 NPM_CACHE = config.CACHE_DIR / "npm"
 
+logger = logging.getLogger("uvicorn")
+
+# Strong references to fire-and-forget prefetch tasks until they finish
+_background_tasks: set[asyncio.Task] = set()
+
 router = APIRouter(prefix="/npm", tags=["npm"])
 
 
@@ -49,12 +61,139 @@ def encode_scoped_package(pkg: str) -> str:
     return quote(pkg)
 
 
+@lru_cache(maxsize=8192)
+def _metadata_locations(package: str) -> tuple[Path, str]:
+    """
+    Return the (local cache path, upstream URL) pair for package metadata.
+    Callers must validate the package name first; ValidationError propagates
+    (and is not cached).
+    """
+    local_path = safe_join_path(NPM_CACHE, package, "index.json")
+    return local_path, f"{NPM_UPSTREAM}/{encode_scoped_package(package)}"
+
+
+@lru_cache(maxsize=8192)
+def _tarball_locations(package: str, tarball: str) -> tuple[Path, str]:
+    """
+    Return the (local cache path, upstream URL) pair for a package tarball.
+    Callers must validate package and tarball names first.
+    """
+    local_path = safe_join_path(NPM_CACHE, package, "-", tarball)
+    return local_path, f"{NPM_UPSTREAM}/{encode_scoped_package(package)}/-/{quote(tarball)}"
+
+
+async def _serve_or_fetch(
+    request: Request,
+    local_path: Path,
+    upstream_url: str,
+    media_type: str,
+    *,
+    max_age_hours: Optional[int] = None,
+    method: HTTPMethod = HTTPMethod.GET,
+    data: Optional[bytes] = None,
+    attachment: bool = False,
+    immutable: bool = False,
+    not_found: str = "Not found",
+    on_fetch: Optional[Callable[[], None]] = None,
+    refetch_if_missing: bool = False,
+) -> Response:
+    """
+    Fetch upstream_url into local_path when needed, then serve the cached file.
+
+    With max_age_hours set, the file is refreshed once it is older than that;
+    with None (or 0) a cached file never expires and only a missing file is
+    fetched. If a refresh fails because upstream is unreachable or answers
+    5xx, the stale copy is served instead. on_fetch is called after a
+    successful upstream fetch. With refetch_if_missing, a file that was
+    deemed fresh but is gone by the time it is served (e.g. evicted) is
+    fetched once more instead of answering 404.
+    """
+    if max_age_hours:
+        should_fetch = utils.is_cache_stale(local_path, max_age_hours=max_age_hours)
+    else:
+        should_fetch = not local_path.exists()
+
+    if should_fetch:
+        try:
+            await utils.fetch_and_cache(
+                upstream_url, local_path, method=method, data=data, force_refresh=True,
+                save_validators=bool(max_age_hours),
+            )
+        except (httpx.RequestError, HTTPException) as e:
+            # Upstream unreachable or failing: serve the stale copy if we have one
+            upstream_failed = not isinstance(e, HTTPException) or e.status_code >= 500
+            if not (upstream_failed and local_path.exists()):
+                raise
+            logger.warning(
+                "Upstream refresh of %s failed (%s); serving stale cache", upstream_url, e
+            )
+        else:
+            if on_fetch is not None:
+                on_fetch()
+
+    try:
+        return await utils.conditional_file_response(
+            request, local_path, media_type, attachment=attachment, immutable=immutable
+        )
+    except FileNotFoundError:
+        if not refetch_if_missing or should_fetch:
+            raise HTTPException(status_code=404, detail=not_found)
+
+    await utils.fetch_and_cache(
+        upstream_url, local_path, method=method, data=data, force_refresh=True
+    )
+    try:
+        return await utils.conditional_file_response(
+            request, local_path, media_type, attachment=attachment, immutable=immutable
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=not_found)
+
+
+def _latest_tarball_name(metadata_path: Path) -> Optional[str]:
+    """Return the tarball filename of dist-tags.latest from cached metadata."""
+    metadata = orjson.loads(metadata_path.read_bytes())
+    latest = metadata.get("dist-tags", {}).get("latest")
+    tarball_url = (
+        metadata.get("versions", {}).get(latest, {}).get("dist", {}).get("tarball")
+    )
+    if not tarball_url:
+        return None
+    return tarball_url.rsplit("/", 1)[-1]
+
+
+async def _prefetch_latest_tarball(package: str, metadata_path: Path) -> None:
+    """
+    Warm the cache with the tarball of the package's latest version.
+    Best effort: failures are logged and otherwise ignored.
+    """
+    try:
+        # Metadata for popular packages is several MB; parse it off the loop
+        tarball = await asyncio.to_thread(_latest_tarball_name, metadata_path)
+        if not tarball or not validate_tarball_name(tarball):
+            return
+        local_path, upstream_url = _tarball_locations(package, tarball)
+        if not local_path.exists():
+            await utils.fetch_and_cache(upstream_url, local_path)
+    except Exception as e:
+        logger.debug("Tarball prefetch for %s failed: %s", package, e)
+
+
+def _schedule_latest_tarball_prefetch(package: str, metadata_path: Path) -> None:
+    if not config.NPM_PREFETCH_LATEST_TARBALL:
+        return
+    task = asyncio.create_task(_prefetch_latest_tarball(package, metadata_path))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 @router.get("/{package:path}")
 async def npm_package_metadata(package: str, request: Request):
     """
     Serve package metadata (package.json-style).
     Example: GET /npm/lodash or /npm/@types/react
-    Only cache metadata; do NOT prefetch tgz files.
+    After fetching metadata from upstream, the latest version's tarball is
+    prefetched in the background (see NPM_PREFETCH_LATEST_TARBALL).
     """
     # SECURITY: Validate package name format
     if not validate_npm_package_name(package):
@@ -65,21 +204,19 @@ async def npm_package_metadata(package: str, request: Request):
 
     try:
         # Use safe path joining with validation
-        local_path = safe_join_path(NPM_CACHE, package, "index.json")
+        local_path, upstream_url = _metadata_locations(package)
     except ValidationError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    # Use is_cache_stale from utils.py for 24h staleness check
-    if utils.is_cache_stale(local_path, max_age_hours=config.NPM_METADATA_TTL_HOURS):
-        upstream_url = f"{NPM_UPSTREAM}/{encode_scoped_package(package)}"
-        await utils.fetch_and_cache(upstream_url, local_path)
-
-    try:
-        return await utils.conditional_file_response(
-            request, local_path, "application/json"
-        )
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Package not found")
+    return await _serve_or_fetch(
+        request,
+        local_path,
+        upstream_url,
+        "application/json",
+        max_age_hours=config.NPM_METADATA_TTL_HOURS,
+        not_found="Package not found",
+        on_fetch=lambda: _schedule_latest_tarball_prefetch(package, local_path),
+    )
 
 
 @router.get("/{package:path}/-/{tarball}")
@@ -105,20 +242,19 @@ async def npm_package_tarball(package: str, tarball: str, request: Request):
 
     try:
         # Use safe path joining
-        local_path = safe_join_path(NPM_CACHE, package, "-", tarball)
+        local_path, upstream_url = _tarball_locations(package, tarball)
     except ValidationError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    if not local_path.exists():
-        upstream_url = f"{NPM_UPSTREAM}/{encode_scoped_package(package)}/-/{quote(tarball)}"
-        await utils.fetch_and_cache(upstream_url, local_path)
-
-    try:
-        return await utils.conditional_file_response(
-            request, local_path, "application/octet-stream", attachment=True
-        )
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Tarball not found")
+    return await _serve_or_fetch(
+        request,
+        local_path,
+        upstream_url,
+        "application/octet-stream",
+        attachment=True,
+        immutable=True,
+        not_found="Tarball not found",
+    )
 
 
 @router.post("/-/npm/v1/security/advisories/bulk")
@@ -127,6 +263,7 @@ async def npm_security_bulk(request: Request):
     Proxy npm audit bulk requests.
     Save response to cache based on a hash of the POST body.
     Invalidate cache if older than 24 hours (for security advisories).
+    The upstream JSON is stored and served byte-for-byte; it is never decoded.
     """
     import hashlib
 
@@ -140,22 +277,14 @@ async def npm_security_bulk(request: Request):
     except ValidationError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    # Use is_cache_stale from utils.py for 24h staleness check
-    if utils.is_cache_stale(local_path, max_age_hours=config.NPM_METADATA_TTL_HOURS):
-        upstream_url = f"{NPM_UPSTREAM}/-/npm/v1/security/advisories/bulk"
-        data = await utils.fetch_and_cache(
-            upstream_url, local_path, method=HTTPMethod.POST, data=body_bytes
-        )
-        return data
-
-    try:
-        return await utils.conditional_file_response(
-            request, local_path, "application/json"
-        )
-    except FileNotFoundError:
-        # Cache miss or staleness check: fetch from upstream
-        upstream_url = f"{NPM_UPSTREAM}/-/npm/v1/security/advisories/bulk"
-        data = await utils.fetch_and_cache(
-            upstream_url, local_path, method=HTTPMethod.POST, data=body_bytes
-        )
-        return data
+    return await _serve_or_fetch(
+        request,
+        local_path,
+        f"{NPM_UPSTREAM}/-/npm/v1/security/advisories/bulk",
+        "application/json",
+        max_age_hours=config.NPM_METADATA_TTL_HOURS,
+        method=HTTPMethod.POST,
+        data=body_bytes,
+        not_found="Advisories not found",
+        refetch_if_missing=True,
+    )
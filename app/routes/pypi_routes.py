@@ -17,16 +17,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from fastapi import APIRouter, HTTPException, Request
 from datetime import datetime, timedelta
+from pathlib import Path
+import asyncio
+import hashlib
+import os
+import re
+import threading
 import httpx
 import app.config as config
 import app.utils as utils
 
 from app.validators import (
     validate_pypi_package_name,
+    validate_pypi_artifact_path,
     validate_version_string,
     safe_join_path,
     ValidationError
@@ -37,41 +43,86 @@ router = APIRouter(prefix="/pypi", tags=["PyPI"])
 PYPI_UPSTREAM = "https://pypi.org"
 PYPI_CACHE = config.CACHE_DIR / "pypi"
 
+# Digest of the upstream body last written to each simple-index file, so an
+# unchanged upstream page skips the rewrite. Oldest entries are evicted first.
+# Updated from worker threads (see store_index), hence the lock.
+_INDEX_DIGESTS: dict[Path, bytes] = {}
+_INDEX_DIGESTS_MAX = 4096
+_INDEX_DIGESTS_LOCK = threading.Lock()
+
+# Splits an href into optional http(s) host, path, and "?query#fragment" tail;
+# compiled once because it runs for every link on every rewritten index page.
+_HREF_RE = re.compile(
+    r"(?:https?://(?P<host>[^/?#]*))?(?P<path>[^?#]*)(?P<rest>[?#].*)?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _proxy_href(orig: str, base_url: str) -> str:
+    """Map a single simple-index href onto the proxy, keeping query/fragment."""
+    m = _HREF_RE.match(orig)
+    host, path, rest = m.group("host"), m.group("path"), m.group("rest") or ""
+
+    if host is not None:
+        host = host.lower()
+        if host.endswith("files.pythonhosted.org") and "/packages/" in path:
+            suffix = path.split("/packages/", 1)[1]
+            return f"{base_url}/packages/{suffix}{rest}"
+        if host.endswith("pypi.org"):
+            path = path.lstrip("/")
+            return (f"{base_url}/{path}" if path else f"{base_url}/") + rest
+        return orig
+
+    # relative URL
+    rel = path.lstrip("/")
+    if rel.startswith(("packages/", "pypi/")):
+        return f"{base_url}/{rel}{rest}"
+    return orig
+
 
 def rewrite_index_html(html: str, base_url: str) -> str:
     """Rewrite PyPI simple index links to route through proxy."""
-    soup = BeautifulSoup(html, "html.parser")
-
-    for a in soup.find_all("a", href=True):
-        orig: str = str(a["href"])
-        parsed = urlparse(orig)
-        new_href = orig
-
-        if parsed.scheme in ("http", "https"):
-            host = parsed.netloc.lower()
-            if host.endswith("files.pythonhosted.org") and "/packages/" in parsed.path:
-                suffix = parsed.path.split("/packages/", 1)[1]
-                new_href = f"{base_url}/packages/{suffix}"
-            elif host.endswith("pypi.org"):
-                path = parsed.path.lstrip("/")
-                new_href = f"{base_url}/{path}" if path else f"{base_url}/"
-        else:
-            # relative URL
-            rel = orig.lstrip("/")
-            if rel.startswith("packages/"):
-                suffix = rel[len("packages/"):]
-                new_href = f"{base_url}/packages/{suffix}"
-            elif rel.startswith("pypi/"):
-                new_href = f"{base_url}/{rel}"
-
-        if parsed.query:
-            new_href += f"?{parsed.query}"
-        if parsed.fragment:
-            new_href += f"#{parsed.fragment}"
-
-        a["href"] = new_href
-
-    return str(soup)
+    tree = LexborHTMLParser(html)
+
+    for a in tree.css("a[href]"):
+        orig = a.attributes.get("href") or ""
+        new_href = _proxy_href(orig, base_url)
+        if new_href != orig:
+            a.attrs["href"] = new_href
+
+    return tree.html or ""
+
+
+def write_index(local_path: Path, upstream_html: str, rewrite: bool = True) -> None:
+    """
+    Store a simple-index page. If upstream returned the same body as last
+    time, only the mtime is refreshed so the TTL restarts without re-parsing.
+    """
+    digest = hashlib.blake2b(upstream_html.encode("utf-8"), digest_size=16).digest()
+    if _INDEX_DIGESTS.get(local_path) == digest and local_path.exists():
+        os.utime(local_path)
+        return
+
+    html = rewrite_index_html(upstream_html, base_url="/pypi") if rewrite else upstream_html
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    # Replaced atomically: other requests may be streaming the old page
+    utils.write_file_atomic(local_path, html.encode("utf-8"))
+
+    with _INDEX_DIGESTS_LOCK:
+        _INDEX_DIGESTS.pop(local_path, None)
+        if len(_INDEX_DIGESTS) >= _INDEX_DIGESTS_MAX:
+            _INDEX_DIGESTS.pop(next(iter(_INDEX_DIGESTS)))
+        _INDEX_DIGESTS[local_path] = digest
+
+
+def store_index(local_path: Path, resp, rewrite: bool = True) -> None:
+    """
+    Write a 200 simple-index response and its upstream validators. Decoding,
+    hashing and rewriting the page are CPU-bound (the root index is tens of
+    MB), so routes run this in a worker thread.
+    """
+    write_index(local_path, resp.text, rewrite=rewrite)
+    utils.save_upstream_validators(local_path, resp)
 
 
 @router.get("/simple/")
@@ -80,13 +131,12 @@ async def pypi_root_index(request: Request):
 
     # Check if cache is stale (older than 24 hours)
     if utils.is_cache_stale(local_path, max_age_hours=config.PYPI_METADATA_TTL_HOURS):
-        async with httpx.AsyncClient(follow_redirects=True, timeout=60.0) as client:
-            r = await client.get(f"{PYPI_UPSTREAM}/simple/")
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code)
-
-            local_path.parent.mkdir(parents=True, exist_ok=True)
-            local_path.write_text(r.text, encoding="utf-8")
+        client = utils.get_http_client()
+        r = await utils.revalidate(client, f"{PYPI_UPSTREAM}/simple/", local_path)
+        if r.status_code == 200:
+            await asyncio.to_thread(store_index, local_path, r, rewrite=False)
+        elif r.status_code != 304:
+            raise HTTPException(status_code=r.status_code)
 
     return await utils.conditional_file_response(request, local_path, "text/html")
 
@@ -115,14 +165,12 @@ async def pypi_package_index(package: str, request: Request):
     if utils.is_cache_stale(local_path, config.PYPI_METADATA_TTL_HOURS):
         url = f"{PYPI_UPSTREAM}/simple/{package}/"
         try:
-            async with httpx.AsyncClient(follow_redirects=True, timeout=60.0) as client:
-                r = await client.get(url)
-                if r.status_code == 200:
-                    rewritten = rewrite_index_html(r.text, base_url="/pypi")
-                    local_path.parent.mkdir(parents=True, exist_ok=True)
-                    local_path.write_text(rewritten, encoding="utf-8")
-                elif not local_path.exists():
-                    raise HTTPException(status_code=r.status_code)
+            client = utils.get_http_client()
+            r = await utils.revalidate(client, url, local_path)
+            if r.status_code == 200:
+                await asyncio.to_thread(store_index, local_path, r)
+            elif r.status_code != 304 and not local_path.exists():
+                raise HTTPException(status_code=r.status_code)
         except httpx.RequestError:
             # Network error - serve stale cache if available
             if not local_path.exists():
@@ -134,6 +182,13 @@ async def pypi_package_index(package: str, request: Request):
 
 @router.get("/packages/{path:path}")
 async def pypi_artifact(path: str, request: Request):
+    # SECURITY: Validate artifact path
+    if not validate_pypi_artifact_path(path):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid PyPI artifact path: {path}"
+        )
+
     try:
         local_path = utils.safe_cache_path(PYPI_CACHE, "packages", path)
     except ValueError as e:
@@ -147,7 +202,10 @@ async def pypi_artifact(path: str, request: Request):
 
     try:
         attachment = local_path.suffix in [".whl", ".zip", ".gz", ".tar"]
-        return await utils.conditional_file_response(request, local_path, "application/octet-stream", attachment=attachment)
+        return await utils.conditional_file_response(
+            request, local_path, "application/octet-stream",
+            attachment=attachment, immutable=True
+        )
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Artifact not found")
 
@@ -17,24 +17,36 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Iterable, Optional
+from typing import AsyncIterator, Iterable, Optional
+from functools import lru_cache
+from collections import OrderedDict
 from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse
 from pathlib import Path
-from datetime import datetime, timezone
+from email.utils import formatdate
 from http import HTTPMethod
+from stat import S_ISREG
+import asyncio
+import gzip
 import hashlib
-import json
 import logging
+import ssl
 import httpx
+import orjson
 import aiofiles
+import aiofiles.tempfile
 import os
 import tempfile
 import time
 
 import app.config as config
+from app.validators import resolved_root
 
 logger = logging.getLogger("uvicorn")
 
+# Compression level for precompressed JSON sidecars (see gzip_sidecar_path)
+GZIP_LEVEL = 6
+
 
 # ----------------------------------------------------------------------
 # Path safety utilities
@@ -45,8 +57,6 @@ def safe_cache_path(cache_root: Path, *parts: Iterable[str]) -> Path:
     Rejects absolute paths, drive letters, UNC paths, and traversal attempts.
     Works cross-platform (POSIX/Windows).
     """
-    cache_root = cache_root.resolve()
-
     segments: list[str] = []
     for p in parts:
         if p is None:
@@ -74,23 +84,270 @@ def safe_cache_path(cache_root: Path, *parts: Iterable[str]) -> Path:
                 raise ValueError(f"Path traversal not allowed: {p}")
             segments.append(seg)
 
-    candidate = cache_root.joinpath(*segments)
+    # Resolve once as a string and check containment by prefix; cheaper than
+    # building and resolving intermediate Path objects.
+    root_real = str(resolved_root(cache_root))
+    candidate_real = os.path.realpath(os.path.join(root_real, *segments))
+
+    if candidate_real != root_real and not candidate_real.startswith(
+        root_real.rstrip(os.sep) + os.sep
+    ):
+        raise ValueError(f"Refused unsafe path outside cache: {candidate_real}")
+
+    return Path(candidate_real)
+# ----------------------------------------------------------------------
+# Precompressed sidecars
+# ----------------------------------------------------------------------
+
+# Sidecar files are named "<name>#<kind>". No route validator admits "#",
+# and conditional_file_response refuses such names, so sidecars can never
+# be requested as if they were artifacts (and "foo.tar.gz" stays a tarball).
+SIDECAR_SEP = "#"
+
+
+def gzip_sidecar_path(path: Path) -> Path:
+    """Location of the precompressed copy of a cached file (``<name>#gz``)."""
+    return path.with_name(f"{path.name}{SIDECAR_SEP}gz")
 
+
+def _write_gzip_sidecar(dest: Path, content: Optional[bytes] = None) -> None:
+    """
+    Store a gzip-compressed copy of ``content`` (default: the bytes of
+    ``dest``) next to ``dest`` so it can be served with
+    ``Content-Encoding: gzip`` without compressing per request.
+    Written atomically like the primary file.
+    """
+    if content is None:
+        content = dest.read_bytes()
+    write_file_atomic(
+        gzip_sidecar_path(dest), gzip.compress(content, compresslevel=GZIP_LEVEL)
+    )
+
+
+def write_file_atomic(dest: Path, data: bytes) -> None:
+    """
+    Blocking counterpart of _atomic_write: write ``data`` to a temp file in
+    dest's directory, fsync it, then os.replace() it over ``dest``. Readers
+    (including FileResponse streams already under way) keep the old file
+    and never see a truncated one.
+    """
+    tmpname = None
     try:
-        candidate_abs = candidate.resolve(strict=False)
-    except (FileNotFoundError, TypeError):
-        parent_resolved = candidate.parent.resolve()
-        candidate_abs = parent_resolved.joinpath(candidate.name)
+        with tempfile.NamedTemporaryFile(
+            mode="wb", delete=False, dir=str(dest.parent)
+        ) as tf:
+            tf.write(data)
+            tf.flush()
+            os.fsync(tf.fileno())
+            tmpname = tf.name
+        os.replace(tmpname, str(dest))
+    finally:
+        try:
+            if tmpname and os.path.exists(tmpname):
+                os.unlink(tmpname)
+        except Exception:
+            pass
+
 
+# ----------------------------------------------------------------------
+# Upstream validators (ETag / Last-Modified) for conditional refreshes
+# ----------------------------------------------------------------------
+def validators_sidecar_path(path: Path) -> Path:
+    """Location of the upstream ETag/Last-Modified recorded for a cached file."""
+    return path.with_name(f"{path.name}{SIDECAR_SEP}etag")
+
+
+def save_upstream_validators(dest: Path, resp) -> None:
+    """Record the ETag/Last-Modified upstream sent with ``dest``'s body, if any."""
+    etag = resp.headers.get("etag", "")
+    last_modified = resp.headers.get("last-modified", "")
+
+    sidecar = validators_sidecar_path(dest)
+    if not etag and not last_modified:
+        sidecar.unlink(missing_ok=True)
+        return
+    sidecar.write_text(f"{etag}\n{last_modified}\n", encoding="utf-8")
+
+
+def upstream_validator_headers(dest: Path) -> dict:
+    """
+    If-None-Match / If-Modified-Since headers for revalidating ``dest``
+    upstream; empty if dest or its recorded validators are missing.
+    """
+    if not dest.exists():
+        return {}
     try:
-        candidate_abs.relative_to(cache_root)
-    except ValueError:
-        raise ValueError(f"Refused unsafe path outside cache: {candidate_abs}")
+        etag, last_modified = validators_sidecar_path(dest).read_text(
+            encoding="utf-8"
+        ).split("\n")[:2]
+    except (OSError, ValueError):
+        return {}
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def mark_revalidated(dest: Path) -> None:
+    """
+    Upstream confirmed ``dest`` is unchanged (304): bump its mtime so the TTL
+    restarts, keeping a current gzip sidecar current.
+    """
+    sidecar = gzip_sidecar_path(dest)
+    sidecar_current = _sidecar_is_current(dest, sidecar)
+    os.utime(dest)
+    if sidecar_current:
+        os.utime(sidecar)
+
+
+async def revalidate(client: httpx.AsyncClient, url: str, dest: Path) -> httpx.Response:
+    """
+    GET ``url`` conditionally on the validators saved for ``dest``. A 304
+    marks dest as revalidated; any other response is returned for the caller
+    to store (and pass to save_upstream_validators).
+    """
+    resp = await client.get(url, headers=upstream_validator_headers(dest))
+    if resp.status_code == 304:
+        mark_revalidated(dest)
+    return resp
+
+
+def _is_json_response(resp) -> bool:
+    return "json" in resp.headers.get("content-type", "").lower()
+
+
+# ----------------------------------------------------------------------
+# Shared upstream HTTP client
+# ----------------------------------------------------------------------
+def _make_ssl_context() -> ssl.SSLContext:
+    """
+    httpx's default TLS context (certifi's bundle, or SSL_CERT_FILE /
+    SSL_CERT_DIR when set) plus config.SSL_CA_FILE, if set.
+    """
+    context = httpx.create_ssl_context(trust_env=True)
+    if config.SSL_CA_FILE:
+        context.load_verify_locations(cafile=config.SSL_CA_FILE)
+    return context
+
+
+# Built once at import: loading the CA bundle dominates client construction
+_SSL_CONTEXT = _make_ssl_context()
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _make_transport() -> Optional[httpx.AsyncBaseTransport]:
+    """
+    Transport for the shared client: None (httpx's own connection pool) by
+    default, or aiohttp's connector via httpx-aiohttp when
+    config.HTTP_BACKEND is "aiohttp". The httpx API is the same either way.
+    """
+    if config.HTTP_BACKEND != "aiohttp":
+        return None
+
+    import aiohttp
+    from httpx_aiohttp import AiohttpTransport
+
+    return AiohttpTransport(
+        client=lambda: aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.HTTP_MAX_CONNECTIONS, ttl_dns_cache=300, ssl=_SSL_CONTEXT
+            )
+        )
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide upstream HTTP client, creating it on first use.
+    Reusing one client keeps connections (and TLS sessions) to the registries
+    alive across requests. Closed by close_http_client() at app shutdown.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # HTTP/2 multiplexes parallel fetches to the same registry host over
+        # one TLS connection (ignored by the aiohttp transport).
+        _http_client = httpx.AsyncClient(
+            http2=config.HTTP2_ENABLED,
+            follow_redirects=True,
+            verify=_SSL_CONTEXT,
+            timeout=httpx.Timeout(config.REQUEST_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(
+                max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                max_connections=config.HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=60,
+            ),
+            transport=_make_transport(),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared upstream HTTP client, if one was created."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
-    return candidate_abs
 # ----------------------------------------------------------------------
 # Network fetch + local caching (atomic, safe)
 # ----------------------------------------------------------------------
+# Upstream bodies are read in 64 KiB chunks and written through a 128 KiB
+# buffer (vs. the ~8 KiB default), so a multi-MB artifact costs a few dozen
+# write() syscalls rather than hundreds.
+STREAM_CHUNK_SIZE = 64 * 1024
+WRITE_BUFFER_SIZE = 128 * 1024
+
+# dest -> future resolved when the fetch currently writing that file finishes
+_INFLIGHT: dict[Path, asyncio.Future] = {}
+
+
+async def _atomic_write(dest: Path, data: bytes | AsyncIterator[bytes]) -> None:
+    """
+    Write ``data`` (bytes or an async iterator of chunks) to a temp file in
+    dest's directory via aiofiles, fsync it, then os.replace() it over
+    ``dest`` so readers never see a partial file. None of the disk writes run
+    on the event loop.
+    """
+    tmpname = None
+    try:
+        async with aiofiles.tempfile.NamedTemporaryFile(
+            "wb", buffering=WRITE_BUFFER_SIZE, delete=False, dir=str(dest.parent)
+        ) as tf:
+            tmpname = tf.name
+            if isinstance(data, bytes):
+                await tf.write(data)
+            else:
+                async for chunk in data:
+                    await tf.write(chunk)
+            await tf.flush()
+            await asyncio.to_thread(os.fsync, tf.fileno())
+        os.replace(tmpname, str(dest))
+    finally:
+        try:
+            if tmpname and os.path.exists(tmpname):
+                os.unlink(tmpname)
+        except Exception:
+            pass
+
+
+async def _stream_to_file(
+    client: httpx.AsyncClient, url: str, dest: Path, headers: dict, timeout: float
+) -> httpx.Response:
+    """
+    GET ``url`` into ``dest`` chunk by chunk so large artifacts never sit in
+    memory whole. A 304 (``headers`` carried validators) leaves dest as is.
+    """
+    async with client.stream("GET", url, headers=headers, timeout=timeout) as resp:
+        if resp.status_code == 304:
+            return resp
+        resp.raise_for_status()
+        await _atomic_write(dest, resp.aiter_bytes(STREAM_CHUNK_SIZE))
+    return resp
 
 
 async def fetch_and_cache(
@@ -101,6 +358,7 @@ async def fetch_and_cache(
     return_json: bool = False,
     timeout: float = 60.0,
     force_refresh: bool = False,
+    save_validators: bool = False,
 ):
     """
     Fetch from upstream (GET or POST), save to local cache atomically, optionally return JSON.
@@ -113,12 +371,21 @@ async def fetch_and_cache(
         return_json: If True, parse and return JSON content
         timeout: Request timeout in seconds
         force_refresh: If True, fetch even if file exists (for cache refresh)
+        save_validators: If True (GET only), record upstream's ETag/Last-Modified
+            so later refreshes can revalidate; for files that are refreshed
+            (metadata, indexes), pointless for immutable artifacts
 
     Security notes:
     - Rejects destinations not under config.CACHE_DIR.
     - Writes to temp file in same directory, then os.replace() atomically.
+
+    Concurrent calls for the same dest share a single upstream fetch.
+    Refreshes of an existing file send the upstream ETag/Last-Modified saved
+    with it, if any (see save_validators); a 304 just restarts its TTL.
+    Plain GETs are streamed straight to disk (see _stream_to_file).
+    JSON responses also get a gzip sidecar (see gzip_sidecar_path).
     """
-    cache_root = config.CACHE_DIR.resolve()
+    cache_root = resolved_root(config.CACHE_DIR)
     try:
         dest_abs = dest.resolve(strict=False)
         dest_abs.relative_to(cache_root)
@@ -130,60 +397,100 @@ async def fetch_and_cache(
 
     # Return existing cache if not forcing refresh
     if dest.exists() and not force_refresh:
-        if return_json:
-            async with aiofiles.open(dest, "r", encoding="utf-8") as f:
-                content = await f.read()
-            return json.loads(content)
-        return dest
+        return await _read_cached(dest, return_json)
+
+    # Single-flight: if this file is already being fetched, wait for that
+    # fetch and share its outcome instead of downloading it again. If that
+    # fetch's own caller was cancelled (e.g. its client disconnected), the
+    # waiters are not: they retry, and one of them takes over the download.
+    while (inflight := _INFLIGHT.get(dest)) is not None:
+        try:
+            await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled() or asyncio.current_task().cancelling():
+                raise
+            continue
+        return await _read_cached(dest, return_json)
 
+    done = _INFLIGHT[dest] = asyncio.get_running_loop().create_future()
+    try:
+        result = await _download(
+            url, dest, method, data, return_json, timeout, save_validators
+        )
+    except asyncio.CancelledError:
+        done.cancel()
+        raise
+    except BaseException as e:
+        done.set_exception(e)
+        done.exception()  # waiters re-raise it; don't warn if there are none
+        raise
+    else:
+        done.set_result(None)
+        return result
+    finally:
+        _INFLIGHT.pop(dest, None)
+
+
+async def _read_cached(dest: Path, return_json: bool):
+    """Return an already-cached file the way fetch_and_cache would."""
+    if return_json:
+        async with aiofiles.open(dest, "rb") as f:
+            content = await f.read()
+        return orjson.loads(content)
+    return dest
+
+
+async def _download(
+    url: str,
+    dest: Path,
+    method: HTTPMethod,
+    data: bytes | None,
+    return_json: bool,
+    timeout: float,
+    save_validators: bool,
+):
+    """Fetch ``url`` from upstream and store it at ``dest`` (fetch_and_cache's miss path)."""
     # Create parent directories if needed
     dest.parent.mkdir(parents=True, exist_ok=True)
 
-    # Fetch from upstream
-    async with httpx.AsyncClient(follow_redirects=True, timeout=timeout) as client:
-        try:
-            if method == HTTPMethod.POST:
-                resp = await client.post(url, content=data)
-            else:
-                resp = await client.get(url)
-            resp.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=e.response.status_code,
-                detail=f"Upstream error: {url}",
-            ) from e
-
-    # Atomic write: temp file in same directory, then replace.
-    tmpname = None
+    # Fetch from upstream over the shared client (connection reuse, HTTP/2
+    # or the aiohttp transport per config); the timeout applies per request.
+    client = get_http_client()
     try:
-        if return_json:
-            text = resp.text
-            with tempfile.NamedTemporaryFile(
-                mode="w", encoding="utf-8", delete=False, dir=str(dest.parent)
-            ) as tf:
-                tf.write(text)
-                tf.flush()
-                os.fsync(tf.fileno())
-                tmpname = tf.name
-            os.replace(tmpname, str(dest))
-            return json.loads(text)
+        if method == HTTPMethod.POST:
+            resp = await client.post(url, content=data, timeout=timeout)
         else:
-            content_bytes = resp.content
-            with tempfile.NamedTemporaryFile(
-                mode="wb", delete=False, dir=str(dest.parent)
-            ) as tf:
-                tf.write(content_bytes)
-                tf.flush()
-                os.fsync(tf.fileno())
-                tmpname = tf.name
-            os.replace(tmpname, str(dest))
-            return dest
-    finally:
-        try:
-            if tmpname and os.path.exists(tmpname):
-                os.unlink(tmpname)
-        except Exception:
-            pass
+            # Refreshing an existing file: let upstream answer 304
+            headers = upstream_validator_headers(dest)
+            if not return_json:
+                resp = await _stream_to_file(client, url, dest, headers, timeout)
+                if resp.status_code == 304:
+                    mark_revalidated(dest)
+                    return dest
+                if save_validators:
+                    await asyncio.to_thread(save_upstream_validators, dest, resp)
+                if _is_json_response(resp):
+                    await asyncio.to_thread(_write_gzip_sidecar, dest)
+                return dest
+            resp = await client.get(url, headers=headers, timeout=timeout)
+            if resp.status_code == 304:
+                mark_revalidated(dest)
+                return await _read_cached(dest, return_json)
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(
+            status_code=e.response.status_code,
+            detail=f"Upstream error: {url}",
+        ) from e
+
+    # Atomic write: temp file in same directory, then replace.
+    content_bytes = resp.content
+    await _atomic_write(dest, content_bytes)
+    if save_validators and method == HTTPMethod.GET:
+        await asyncio.to_thread(save_upstream_validators, dest, resp)
+    if _is_json_response(resp):
+        await asyncio.to_thread(_write_gzip_sidecar, dest, content_bytes)
+    return orjson.loads(content_bytes) if return_json else dest
 
 
 # ----------------------------------------------------------------------
@@ -194,19 +501,59 @@ def open_cached_file(path: Path) -> bytes:
     Read bytes from cached file.
     Caller should have validated containment; refuses non-files.
     """
-    if path.exists() and path.is_file():
-        return path.read_bytes()
-    raise FileNotFoundError(path)
+    # One open() + fstat() instead of separate exists/is_file/read lookups
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except (IsADirectoryError, PermissionError):
+        raise FileNotFoundError(path)
+    if not S_ISREG(os.fstat(fd).st_mode):
+        os.close(fd)
+        raise FileNotFoundError(path)
+    with os.fdopen(fd, "rb") as f:
+        return f.read()
 
 
-def make_etag_and_last_modified(path: Path):
-    stat = path.stat()
-    etag = hashlib.sha256(
-        f"{path.name}-{stat.st_mtime}-{stat.st_size}".encode("utf-8")
+# ETags are opaque to clients (only equality matters), so a 128-bit digest
+# is plenty and keeps the header short.
+ETAG_HEX_LEN = 32
+
+# LRU of (path, st_mtime_ns, st_size) -> (etag, last_modified); any change
+# to the file produces a new key, so entries never need invalidating.
+_ETAG_CACHE: OrderedDict[tuple[str, int, int], tuple[str, str]] = OrderedDict()
+_ETAG_CACHE_MAX = 1024
+
+
+@lru_cache(maxsize=1024)
+def _http_date(seconds: int) -> str:
+    # HTTP dates carry whole seconds, so many files share one string;
+    # formatdate is also locale-independent, unlike strftime's %a/%b.
+    return formatdate(seconds, usegmt=True)
+
+
+def _stat_and_validators(path: Path) -> tuple[os.stat_result, str, str]:
+    # The ETag hashes name/mtime/size, never the file contents, so its cost
+    # is independent of artifact size: one os.stat() plus, on a hit, a lookup.
+    # The stat result is returned too so callers never stat the file again.
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    cached = _ETAG_CACHE.get(key)
+    if cached is not None:
+        _ETAG_CACHE.move_to_end(key)
+        return stat, *cached
+
+    etag = hashlib.blake2b(
+        f"{path.name}-{stat.st_mtime}-{stat.st_size}".encode("utf-8"),
+        digest_size=ETAG_HEX_LEN // 2,
     ).hexdigest()
-    last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).strftime(
-        "%a, %d %b %Y %H:%M:%S GMT"
-    )
+    last_modified = _http_date(int(stat.st_mtime))
+    _ETAG_CACHE[key] = (etag, last_modified)
+    if len(_ETAG_CACHE) > _ETAG_CACHE_MAX:
+        _ETAG_CACHE.popitem(last=False)
+    return stat, etag, last_modified
+
+
+def make_etag_and_last_modified(path: Path):
+    _, etag, last_modified = _stat_and_validators(path)
     return etag, last_modified
 
 
@@ -218,26 +565,40 @@ def file_headers(path: Path) -> dict:
 # ----------------------------------------------------------------------
 # Conditional file responses with validation
 # ----------------------------------------------------------------------
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Appended to a file's ETag when its gzip sidecar is served
+GZIP_ETAG_SUFFIX = "-gzip"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
 async def conditional_file_response(
     request: Request,
     path: Path,
     media_type: str,
     attachment: Optional[bool] = False,
+    immutable: bool = False,
 ) -> Response:
     """
-    Return a Response with ETag/Last-Modified headers and conditional GET support.
+    Return a FileResponse with ETag/Last-Modified headers and conditional GET
+    support (304 when the client's validators match).
 
     Additional safety:
     - Re-verify path is inside configured cache directory before serving.
     - Optionally refuse serving symlinks (disabled by default).
-    """
-    if not path.exists():
-        raise FileNotFoundError(path)
 
-    cache_root = config.CACHE_DIR.resolve()
+    If the client accepts gzip and an up-to-date gzip sidecar exists, the
+    precompressed bytes are served with ``Content-Encoding: gzip``.
+
+    Cache-Control: immutable artifacts (versioned tarballs, wheels, jars) may
+    be reused by clients/CDNs for a year without asking again; everything
+    else is marked ``no-cache`` so clients revalidate, which the 304 path
+    answers from a stat() and the ETag memo.
+    """
+    cache_root = resolved_root(config.CACHE_DIR)
     try:
         resolved = path.resolve(strict=True)
         resolved.relative_to(cache_root)
+    except FileNotFoundError:
+        raise
     except Exception:
         logger.warning("Refused to serve file outside cache: %s", path)
         raise FileNotFoundError(path)
@@ -247,7 +608,12 @@ async def conditional_file_response(
     #     logger.warning("Refused to serve symlink in cache: %s", resolved)
     #     raise FileNotFoundError(resolved)
 
-    etag, last_modified = make_etag_and_last_modified(resolved)
+    if SIDECAR_SEP in resolved.name:
+        # Internal sidecar (gzip copy, upstream validators), never served directly
+        raise FileNotFoundError(path)
+    stat, etag, last_modified = _stat_and_validators(resolved)
+    if not S_ISREG(stat.st_mode):
+        raise FileNotFoundError(path)
     if_none_match = request.headers.get("if-none-match") or request.headers.get(
         "If-None-Match"
     )
@@ -255,15 +621,67 @@ async def conditional_file_response(
         "if-modified-since"
     ) or request.headers.get("If-Modified-Since")
 
-    if if_none_match == etag or if_modified_since == last_modified:
-        return Response(status_code=304)
-
-    headers = file_headers(resolved)
+    # A current gzip sidecar makes the response vary by Accept-Encoding. The
+    # gzip copy is a different representation, so it gets its own ETag (a
+    # strong validator must differ between content codings, and Range/If-Range
+    # resumes must never splice gzip bytes onto identity bytes).
+    body_path, body_stat = resolved, stat
+    gzip_etag = None
+    if media_type.endswith("json"):
+        sidecar = gzip_sidecar_path(resolved)
+        sidecar_stat = _current_sidecar_stat(sidecar, stat.st_mtime_ns)
+        if sidecar_stat is not None:
+            gzip_etag = etag + GZIP_ETAG_SUFFIX
+            accept_encoding = request.headers.get(
+                "accept-encoding"
+            ) or request.headers.get("Accept-Encoding") or ""
+            if "gzip" in accept_encoding:
+                body_path, body_stat = sidecar, sidecar_stat
+
+    validators = {
+        "ETag": gzip_etag if body_path is not resolved else etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+    }
+    if gzip_etag is not None:
+        validators["Vary"] = "Accept-Encoding"
+
+    # Either coding's ETag identifies the same underlying file
+    if if_none_match in (etag, gzip_etag) and if_none_match is not None:
+        # Nothing below needs the file body
+        return Response(status_code=304, headers={**validators, "ETag": if_none_match})
+    if if_modified_since == last_modified:
+        return Response(status_code=304, headers=validators)
+
+    headers = dict(validators)
     if attachment:
         headers["Content-Disposition"] = f'attachment; filename="{resolved.name}"'
+    if body_path is not resolved:
+        headers["Content-Encoding"] = "gzip"
+
+    # FileResponse streams from disk (sendfile where the server supports it)
+    # and handles Range requests, so the body is never held in memory.
+    # Passing the stat result we already have spares it another os.stat().
+    return FileResponse(
+        body_path, headers=headers, media_type=media_type, stat_result=body_stat
+    )
+
 
-    content = open_cached_file(resolved)
-    return Response(content=content, headers=headers, media_type=media_type)
+def _current_sidecar_stat(sidecar: Path, mtime_ns: int) -> Optional[os.stat_result]:
+    """Stat of ``sidecar`` if it exists and is no older than ``mtime_ns``."""
+    try:
+        sidecar_stat = os.stat(sidecar)
+    except OSError:
+        return None
+    return sidecar_stat if sidecar_stat.st_mtime_ns >= mtime_ns else None
+
+
+def _sidecar_is_current(path: Path, sidecar: Path) -> bool:
+    """True if ``sidecar`` exists and was written no earlier than ``path``."""
+    try:
+        return _current_sidecar_stat(sidecar, path.stat().st_mtime_ns) is not None
+    except OSError:
+        return False
 
 
 def is_cache_stale(path: Path, max_age_hours: int = 24) -> bool:
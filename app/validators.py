@@ -16,7 +16,9 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
+import os
 import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -26,6 +28,29 @@ class ValidationError(ValueError):
     pass
 
 
+# Validator patterns are compiled once at import and their bound fullmatch
+# methods kept as module constants, so each call is a single C-level scan
+# with no pattern-cache or attribute lookup and no "$ matches before a
+# trailing newline" gap.
+_NPM_NAME_FULLMATCH = re.compile(
+    r'@[a-z0-9][a-z0-9._-]*/[a-z0-9][a-z0-9._-]*|[a-z0-9][a-z0-9._-]*',
+    re.IGNORECASE,
+).fullmatch
+_VERSION_FULLMATCH = re.compile(r'[a-zA-Z0-9._+-]+').fullmatch
+_MAVEN_PATH_FULLMATCH = re.compile(r'[a-zA-Z0-9._/-]+').fullmatch
+_TARBALL_NAME_FULLMATCH = re.compile(r'[a-zA-Z0-9._-]+\.(?:tgz|tar\.gz|tar\.bz2|tar\.xz|tar)').fullmatch
+
+# PyPI project name: alphanumeric start, then [A-Za-z0-9._-], 214 chars max
+_PYPI_NAME_FULLMATCH = re.compile(r'[a-zA-Z0-9][a-zA-Z0-9._-]{0,213}').fullmatch
+
+# PyPI artifact path below /packages/: "/"-separated segments of
+# [A-Za-z0-9._+-], none of them "." or ".." (so no traversal, no "//")
+_PYPI_PATH_SEGMENT = r'(?!\.\.?(?:/|$))[a-zA-Z0-9._+-]+'
+_PYPI_ARTIFACT_PATH_FULLMATCH = re.compile(
+    rf'{_PYPI_PATH_SEGMENT}(?:/{_PYPI_PATH_SEGMENT})*'
+).fullmatch
+
+
 def validate_npm_package_name(package: str) -> bool:
     """
     Validate NPM package name format according to NPM specifications.
@@ -54,19 +79,13 @@ def validate_npm_package_name(package: str) -> bool:
     if not package or len(package) > 214:
         return False
     
-    # Check for path traversal attempts
-    if '..' in package or package.startswith('/') or '\\' in package or '\0' in package:
+    # The fullmatch charset already excludes "\\", NUL and a leading "/";
+    # only ".." needs a separate scan.
+    if '..' in package:
         return False
     
-    # NPM scoped package pattern: @scope/name
-    scoped_pattern = r'^@[a-z0-9][a-z0-9._-]*/[a-z0-9][a-z0-9._-]*$'
-    # NPM unscoped package pattern
-    unscoped_pattern = r'^[a-z0-9][a-z0-9._-]*$'
-    
-    return bool(
-        re.match(scoped_pattern, package, re.IGNORECASE) or 
-        re.match(unscoped_pattern, package, re.IGNORECASE)
-    )
+    # NPM scoped (@scope/name) or unscoped package name
+    return _NPM_NAME_FULLMATCH(package) is not None
 
 
 def validate_pypi_package_name(package: str) -> bool:
@@ -93,17 +112,37 @@ def validate_pypi_package_name(package: str) -> bool:
         >>> validate_pypi_package_name("../etc/passwd")
         False
     """
-    if not package or len(package) > 214:
+    # One precompiled fullmatch covers length, charset, and leading "/";
+    # only ".." needs a separate check.
+    if not package or '..' in package:
         return False
-    
-    # Check for path traversal and null bytes
-    if '..' in package or package.startswith('/') or '\\' in package or '\0' in package:
+    return _PYPI_NAME_FULLMATCH(package) is not None
+
+
+def validate_pypi_artifact_path(path: str) -> bool:
+    """
+    Validate a PyPI artifact path (the part after /pypi/packages/).
+
+    Rules:
+    - "/"-separated segments of letters, numbers, dots, hyphens, underscores, plus
+    - No empty, "." or ".." segments (no absolute paths, traversal, or "//")
+    - Length must be <= 1024 characters
+
+    Args:
+        path: Artifact path to validate
+
+    Returns:
+        True if valid, False otherwise
+
+    Examples:
+        >>> validate_pypi_artifact_path("ab/cd/ef0123/requests-2.31.0-py3-none-any.whl")
+        True
+        >>> validate_pypi_artifact_path("../secret/file.whl")
+        False
+    """
+    if not path or len(path) > 1024:
         return False
-    
-    # PyPI allows letters, numbers, hyphens, underscores, dots
-    # Must start with alphanumeric
-    pattern = r'^[a-zA-Z0-9][a-zA-Z0-9._-]*$'
-    return bool(re.match(pattern, package))
+    return _PYPI_ARTIFACT_PATH_FULLMATCH(path) is not None
 
 
 def validate_version_string(version: str) -> bool:
@@ -132,13 +171,12 @@ def validate_version_string(version: str) -> bool:
     if not version or len(version) > 100:
         return False
     
-    # Check for path traversal
-    if '..' in version or '/' in version or '\\' in version or '\0' in version:
+    # The fullmatch charset already excludes "/", "\\" and NUL
+    if '..' in version:
         return False
     
     # Allow semantic versioning and common version formats
-    pattern = r'^[a-zA-Z0-9._+-]+$'
-    return bool(re.match(pattern, version))
+    return _VERSION_FULLMATCH(version) is not None
 
 
 def validate_maven_path(path: str) -> bool:
@@ -167,25 +205,13 @@ def validate_maven_path(path: str) -> bool:
     if not path or len(path) > 1024:
         return False
     
-    # Check for path traversal and dangerous characters
-    if '..' in path or path.startswith('/') or '\\' in path or '\0' in path:
-        return False
-    
-    # Check for absolute paths (Windows and Unix)
-    if path.startswith(('/', '\\', 'C:', 'c:')):
+    # Check for path traversal, absolute paths and double slashes; "\\",
+    # NUL and drive letters ("C:") are outside the fullmatch charset below
+    if '..' in path or path[0] == '/' or '//' in path:
         return False
     
     # Maven paths should only contain alphanumeric, dots, hyphens, underscores, slashes
-    # Allow common file extensions
-    pattern = r'^[a-zA-Z0-9._/-]+$'
-    if not re.match(pattern, path):
-        return False
-    
-    # Additional check: ensure no double slashes
-    if '//' in path:
-        return False
-    
-    return True
+    return _MAVEN_PATH_FULLMATCH(path) is not None
 
 
 def validate_tarball_name(filename: str) -> bool:
@@ -207,18 +233,12 @@ def validate_tarball_name(filename: str) -> bool:
     if not filename or len(filename) > 255:
         return False
     
-    # No path separators or traversal
-    if '/' in filename or '\\' in filename or '..' in filename or '\0' in filename:
+    # No traversal; path separators and NUL are outside the fullmatch charset
+    if '..' in filename:
         return False
     
-    # Must have valid tarball extension
-    valid_extensions = ('.tgz', '.tar.gz', '.tar', '.tar.bz2', '.tar.xz')
-    if not filename.endswith(valid_extensions):
-        return False
-    
-    # Alphanumeric, dots, hyphens, underscores only
-    pattern = r'^[a-zA-Z0-9._-]+\.(?:tgz|tar\.gz|tar\.bz2|tar\.xz|tar)$'
-    return bool(re.match(pattern, filename))
+    # Alphanumeric, dots, hyphens, underscores only, with a tarball extension
+    return _TARBALL_NAME_FULLMATCH(filename) is not None
 
 
 def safe_join_path(base: Path, *parts: str) -> Path:
@@ -226,13 +246,17 @@ def safe_join_path(base: Path, *parts: str) -> Path:
     Safely join path components and ensure result is within base directory.
     
     This is a defense-in-depth measure in addition to input validation.
+    Components are first checked lexically (abspath/normpath); the joined
+    path is then resolved with os.path.realpath so a symlink inside base
+    cannot point it elsewhere. Callers write to the returned path directly,
+    so this check must not be left to the places that serve files.
     
     Args:
         base: Base directory path
         *parts: Path components to join
         
     Returns:
-        Resolved path within base directory
+        Normalized absolute path within base directory
         
     Raises:
         ValidationError: If resulting path is outside base directory
@@ -244,29 +268,48 @@ def safe_join_path(base: Path, *parts: str) -> Path:
         >>> safe_join_path(base, "..", "etc", "passwd")
         ValidationError: Path traversal detected
     """
+    base_str = os.path.abspath(base)
+
     # Join all parts
-    result = base
+    joined = base_str
     for part in parts:
         if not part:
             continue
         # Basic validation on each part
         if '..' in part or part.startswith('/') or '\\' in part or '\0' in part:
             raise ValidationError(f"Invalid path component: {part}")
-        result = result / part
-    
-    # Resolve to absolute path
-    try:
-        resolved = result.resolve()
-        base_resolved = base.resolve()
-    except (OSError, RuntimeError) as e:
-        raise ValidationError(f"Path resolution failed: {e}")
-    
-    # Ensure resolved path is within base directory
-    try:
-        resolved.relative_to(base_resolved)
-    except ValueError:
+        if os.path.isabs(part) or os.path.splitdrive(part)[0]:
+            raise ValidationError(f"Invalid path component: {part}")
+        joined = os.path.join(joined, part)
+
+    joined = os.path.normpath(joined)
+
+    # Ensure normalized path is within base directory
+    if not _is_within(joined, base_str):
         raise ValidationError(
-            f"Path traversal detected: {resolved} is outside {base_resolved}"
+            f"Path traversal detected: {joined} is outside {base_str}"
         )
-    
-    return resolved
\ No newline at end of file
+
+    # ...and still is once symlinks are followed
+    if not _is_within(os.path.realpath(joined), str(resolved_root(base))):
+        raise ValidationError(
+            f"Path traversal detected: {joined} resolves outside {base_str}"
+        )
+
+    return Path(joined)
+
+
+@lru_cache(maxsize=32)
+def resolved_root(root: Path) -> Path:
+    """
+    Real path of a cache root, resolved once per distinct root. Roots are
+    fixed at startup, so this takes Path.resolve() off the per-request path.
+    Shared by safe_join_path and app.utils (safe_cache_path, fetch_and_cache,
+    conditional_file_response); call resolved_root.cache_clear() if a root
+    is moved or re-linked at runtime.
+    """
+    return Path(os.path.realpath(root))
+
+
+def _is_within(path: str, base: str) -> bool:
+    return path == base or path.startswith(base.rstrip(os.sep) + os.sep)
@@ -4,14 +4,13 @@ from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
 from app import main
 import app.config as config
-
-client = TestClient(main.app)
+import app.utils as utils
 
 
 # -----------------------
 # Test root endpoint
 # -----------------------
-def test_root_endpoint():
+def test_root_endpoint(client):
     response = client.get("/")
     assert response.status_code == 200
     data = response.json()
@@ -62,3 +61,19 @@ def test_client_triggers_lifespan():
 
         # Shutdown log should be called after TestClient context exits
         mock_logger.info.assert_any_call("Shutting down FastAPI app")
+
+
+# -----------------------
+# Test shared HTTP client lifecycle
+# -----------------------
+@pytest.mark.asyncio
+async def test_lifespan_closes_shared_http_client():
+    class DummyApp:
+        pass
+
+    async with main.lifespan(DummyApp()):
+        shared = utils.get_http_client()
+        assert utils.get_http_client() is shared
+        assert not shared.is_closed
+
+    assert shared.is_closed
@@ -20,14 +20,10 @@
 
 import pytest
 from fastapi import HTTPException
-from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch
 from pathlib import Path
 from app.routes import maven_routes
 
-client = TestClient(maven_routes.router)
-
-
 @pytest.mark.asyncio
 @patch("app.routes.maven_routes.utils.conditional_file_response", new_callable=AsyncMock)
 @patch("app.routes.maven_routes.utils.fetch_and_cache", new_callable=AsyncMock)
@@ -209,3 +205,64 @@ async def test_maven_proxy_metadata_xml():
                     mock_response.return_value = b"<metadata></metadata>"
                     await maven_routes.maven_proxy(test_path, request=AsyncMock())
                     mock_fetch.assert_called_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("test_path, immutable", [
+    ("com/example/test/1.0/test-1.0.jar", True),
+    ("com/example/test/1.0-SNAPSHOT/test-1.0-20250101.120000-1.jar", False),
+    ("com/example/test/1.0-SNAPSHOT/test-1.0-SNAPSHOT.jar", False),
+    ("com/example/test/maven-metadata.xml", False),
+    ("com/example/test/maven-metadata.xml.sha256", False),
+    ("com/example/test/maven-metadata.xml.sha512", False),
+])
+@patch("app.routes.maven_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.maven_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_maven_proxy_immutable_only_for_releases(
+    mock_fetch, mock_response, test_path, immutable
+):
+    """Only release artifacts get the year-long immutable Cache-Control."""
+    with patch.object(Path, "exists", return_value=True):
+        await maven_routes.maven_proxy(test_path, request=AsyncMock())
+
+    assert mock_response.call_args.kwargs["immutable"] is immutable
+
+
+@pytest.mark.asyncio
+@patch("app.routes.maven_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.maven_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.maven_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_maven_proxy_refreshes_metadata_checksums(mock_fetch, mock_response, mock_stale):
+    """maven-metadata.xml.sha256 is refreshed like maven-metadata.xml."""
+    with patch.object(Path, "exists", return_value=True):
+        await maven_routes.maven_proxy(
+            "com/example/test/maven-metadata.xml.sha256", request=AsyncMock()
+        )
+
+    mock_fetch.assert_called_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sidecar", ["#etag", "#gz"])
+async def test_maven_proxy_rejects_sidecar_names(sidecar):
+    """Internal sidecar files are not addressable through the route."""
+    with pytest.raises(HTTPException) as exc_info:
+        await maven_routes.maven_proxy(
+            f"com/example/test/maven-metadata.xml{sidecar}", request=AsyncMock()
+        )
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.asyncio
+@patch("app.routes.maven_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.maven_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.maven_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_maven_proxy_saves_validators_only_for_metadata(mock_fetch, mock_response, mock_stale):
+    with patch.object(Path, "exists", return_value=False):
+        await maven_routes.maven_proxy("com/example/test/1.0/test-1.0.jar", request=AsyncMock())
+    assert mock_fetch.call_args.kwargs["save_validators"] is False
+
+    with patch.object(Path, "exists", return_value=True):
+        await maven_routes.maven_proxy("com/example/test/maven-metadata.xml", request=AsyncMock())
+    assert mock_fetch.call_args.kwargs["save_validators"] is True
+    assert mock_fetch.call_args.kwargs["force_refresh"] is True
@@ -17,15 +17,34 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import time
+import httpx
 import pytest
 from fastapi import HTTPException
-from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch
 from pathlib import Path
 from app.routes import npm_routes
 
 
+@pytest.fixture(autouse=True)
+def npm_cache(tmp_path, monkeypatch):
+    """Point the npm cache at a per-test temp directory."""
+    cache = tmp_path / "npm"
+    monkeypatch.setattr(npm_routes, "NPM_CACHE", cache)
+    # Location lookups are memoized; reset them so each test sees its own cache
+    npm_routes._metadata_locations.cache_clear()
+    npm_routes._tarball_locations.cache_clear()
+    yield cache
+
+
+def cache_file(path: Path, content: bytes = b"x") -> Path:
+    """Create a cached file (and its parents) to simulate a cache hit."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
 # Test cache staleness logic for npm metadata
 @pytest.mark.asyncio
 @patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
@@ -33,11 +52,69 @@ from app.routes import npm_routes
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
 async def test_npm_package_metadata_stale_refresh(mock_fetch, mock_response, mock_stale):
     test_package = "lodash"
-    with patch.object(Path, "exists", return_value=True):
-        mock_response.return_value = {"name": "lodash"}
-        await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
-        mock_fetch.assert_called_once()
-        mock_response.assert_called_once()
+    mock_response.return_value = {"name": "lodash"}
+    await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
+    mock_fetch.assert_called_once()
+    mock_response.assert_called_once()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("upstream_error", [
+    httpx.ConnectError("connection refused"),
+    HTTPException(status_code=503, detail="Upstream error"),
+])
+@patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_npm_package_metadata_upstream_outage_serves_stale(
+    mock_fetch, mock_response, mock_stale, npm_cache, upstream_error
+):
+    """A failed refresh of a stale entry serves the cached copy."""
+    cache_file(npm_cache / "lodash" / "index.json", b'{"name": "lodash"}')
+    mock_fetch.side_effect = upstream_error
+    mock_response.return_value = "stale response"
+
+    with patch.object(npm_routes, "_schedule_latest_tarball_prefetch") as mock_prefetch:
+        assert await npm_routes.npm_package_metadata("lodash", request=AsyncMock()) == "stale response"
+    mock_prefetch.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_npm_package_metadata_upstream_outage_without_cache(mock_fetch, mock_stale):
+    mock_fetch.side_effect = httpx.ConnectError("connection refused")
+    with pytest.raises(httpx.ConnectError):
+        await npm_routes.npm_package_metadata("lodash", request=AsyncMock())
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_npm_package_metadata_upstream_404_not_masked(mock_fetch, mock_stale, npm_cache):
+    cache_file(npm_cache / "lodash" / "index.json")
+    mock_fetch.side_effect = HTTPException(status_code=404)
+    with pytest.raises(HTTPException) as exc_info:
+        await npm_routes.npm_package_metadata("lodash", request=AsyncMock())
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_npm_security_bulk_upstream_outage_serves_stale(
+    mock_fetch, mock_response, mock_stale, npm_cache
+):
+    body = b'{"lodash":["4.17.20"]}'
+    request_mock = AsyncMock()
+    request_mock.body.return_value = body
+    body_hash = hashlib.sha256(body).hexdigest()[:16]
+    cache_file(npm_cache / "security" / f"{body_hash}.json", b"{}")
+    mock_fetch.side_effect = httpx.ReadTimeout("timed out")
+    mock_response.return_value = "stale advisories"
+
+    assert await npm_routes.npm_security_bulk(request_mock) == "stale advisories"
+
 
 # Test cache freshness logic for npm metadata
 @pytest.mark.asyncio
@@ -46,14 +123,10 @@ async def test_npm_package_metadata_stale_refresh(mock_fetch, mock_response, moc
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
 async def test_npm_package_metadata_fresh_cache(mock_fetch, mock_response, mock_stale):
     test_package = "lodash"
-    with patch.object(Path, "exists", return_value=True):
-        mock_response.return_value = {"name": "lodash"}
-        await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
-        mock_fetch.assert_not_called()
-        mock_response.assert_called_once()
-
-client = TestClient(npm_routes.router)
-
+    mock_response.return_value = {"name": "lodash"}
+    await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
+    mock_fetch.assert_not_called()
+    mock_response.assert_called_once()
 
 @pytest.mark.asyncio
 async def test_encode_scoped_package():
@@ -67,15 +140,17 @@ async def test_encode_scoped_package():
 @patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
 async def test_npm_package_metadata_fetch(mock_fetch, mock_response):
-    test_package = "lodash"
-    local_path = npm_routes.NPM_CACHE / Path(test_package) / "index.json"
+    test_package = "@types/react"
+    local_path = (npm_routes.NPM_CACHE / "@types" / "react" / "index.json").resolve()
 
     # File does not exist -> fetch_and_cache should be called
-    with patch.object(Path, "exists", return_value=False):
-        mock_response.return_value = {"name": "lodash"}
-        response = await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
-        mock_fetch.assert_called_once()
-        mock_response.assert_called_once()
+    mock_response.return_value = {"name": "@types/react"}
+    response = await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
+    mock_fetch.assert_called_once()
+    url, dest = mock_fetch.call_args.args[:2]
+    assert url == f"{npm_routes.NPM_UPSTREAM}/%40types/react"
+    assert dest == local_path
+    mock_response.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -86,11 +161,10 @@ async def test_npm_package_metadata_cached(mock_fetch, mock_response, mock_stale
     test_package = "lodash"
 
     # File exists -> fetch_and_cache should NOT be called
-    with patch.object(Path, "exists", return_value=True):
-        mock_response.return_value = {"name": "lodash"}
-        response = await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
-        mock_fetch.assert_not_called()
-        mock_response.assert_called_once()
+    mock_response.return_value = {"name": "lodash"}
+    response = await npm_routes.npm_package_metadata(test_package, request=AsyncMock())
+    mock_fetch.assert_not_called()
+    mock_response.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -101,26 +175,26 @@ async def test_npm_package_tarball_fetch(mock_fetch, mock_response):
     tarball = "lodash-4.17.21.tgz"
 
     # File does not exist -> fetch_and_cache should be called
-    with patch.object(Path, "exists", return_value=False):
-        mock_response.return_value = b"tarball content"
-        response = await npm_routes.npm_package_tarball(test_package, tarball, request=AsyncMock())
-        mock_fetch.assert_called_once()
-        mock_response.assert_called_once()
+    mock_response.return_value = b"tarball content"
+    response = await npm_routes.npm_package_tarball(test_package, tarball, request=AsyncMock())
+    mock_fetch.assert_called_once()
+    assert mock_fetch.call_args.args[0] == f"{npm_routes.NPM_UPSTREAM}/lodash/-/lodash-4.17.21.tgz"
+    mock_response.assert_called_once()
 
 
 @pytest.mark.asyncio
 @patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
-async def test_npm_package_tarball_cached(mock_fetch, mock_response):
+async def test_npm_package_tarball_cached(mock_fetch, mock_response, npm_cache):
     test_package = "lodash"
     tarball = "lodash-4.17.21.tgz"
+    cache_file(npm_cache / "lodash" / "-" / tarball)
 
     # File exists -> fetch_and_cache should NOT be called
-    with patch.object(Path, "exists", return_value=True):
-        mock_response.return_value = b"cached tarball"
-        response = await npm_routes.npm_package_tarball(test_package, tarball, request=AsyncMock())
-        mock_fetch.assert_not_called()
-        mock_response.assert_called_once()
+    mock_response.return_value = b"cached tarball"
+    response = await npm_routes.npm_package_tarball(test_package, tarball, request=AsyncMock())
+    mock_fetch.assert_not_called()
+    mock_response.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -128,17 +202,17 @@ async def test_npm_package_tarball_cached(mock_fetch, mock_response):
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
 async def test_npm_security_bulk_fetch(mock_fetch, mock_response):
     body = b'{"advisories":[]}'
-    body_hash = str(abs(hash(body)))
-    local_path = npm_routes.NPM_CACHE / "security" / f"{body_hash}.json"
 
-    # File does not exist -> fetch_and_cache should be called
-    with patch.object(Path, "exists", return_value=False):
-        request_mock = AsyncMock()
-        request_mock.body.return_value = body
-        mock_fetch.return_value = {"result": "ok"}
-        response = await npm_routes.npm_security_bulk(request_mock)
-        mock_fetch.assert_called_once()
-        assert response == {"result": "ok"}
+    # File does not exist -> fetch_and_cache should be called, then the
+    # cached bytes are served as-is
+    request_mock = AsyncMock()
+    request_mock.body.return_value = body
+    mock_response.return_value = {"result": "ok"}
+    response = await npm_routes.npm_security_bulk(request_mock)
+    mock_fetch.assert_called_once()
+    assert mock_fetch.call_args.kwargs["data"] == body
+    mock_response.assert_called_once()
+    assert response == {"result": "ok"}
 
 
 @pytest.mark.asyncio
@@ -150,25 +224,26 @@ async def test_npm_security_bulk_cached(mock_response, mock_stale):
     request_mock.body.return_value = body
 
     # File exists and is fresh -> conditional_file_response should be called
-    with patch.object(Path, "exists", return_value=True):
-        mock_response.return_value = {"cached": True}
-        response = await npm_routes.npm_security_bulk(request_mock)
-        mock_response.assert_called_once()
-        assert response == {"cached": True}
+    mock_response.return_value = {"cached": True}
+    response = await npm_routes.npm_security_bulk(request_mock)
+    mock_response.assert_called_once()
+    assert response == {"cached": True}
 
 
 @pytest.mark.asyncio
 @patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
-async def test_npm_security_bulk_stale_refresh(mock_fetch, mock_stale):
+async def test_npm_security_bulk_stale_refresh(mock_fetch, mock_response, mock_stale):
     """Test that security bulk cache is refreshed when stale (>24h old)."""
     body = b'{"advisories":[]}'
     request_mock = AsyncMock()
     request_mock.body.return_value = body
 
-    mock_fetch.return_value = {"freshly": "fetched"}
+    mock_response.return_value = {"freshly": "fetched"}
     response = await npm_routes.npm_security_bulk(request_mock)
     mock_fetch.assert_called_once()
+    assert mock_fetch.call_args.kwargs["force_refresh"] is True
     assert response == {"freshly": "fetched"}
 
 
@@ -232,14 +307,14 @@ async def test_npm_package_tarball_raises_validation_error():
 
 
 @pytest.mark.asyncio
-async def test_npm_package_tarball_file_not_found_error():
+async def test_npm_package_tarball_file_not_found_error(npm_cache):
     """Test that FileNotFoundError from conditional_file_response raises HTTPException(404)."""
+    cache_file(npm_cache / "lodash" / "-" / "missing.tgz")
     with patch("app.routes.npm_routes.utils.conditional_file_response", 
                side_effect=FileNotFoundError("Not found")):
-        with patch.object(Path, "exists", return_value=True):
-            with pytest.raises(HTTPException) as exc_info:
-                await npm_routes.npm_package_tarball("lodash", "missing.tgz", request=AsyncMock())
-            assert exc_info.value.status_code == 404
+        with pytest.raises(HTTPException) as exc_info:
+            await npm_routes.npm_package_tarball("lodash", "missing.tgz", request=AsyncMock())
+        assert exc_info.value.status_code == 404
 
 
 @pytest.mark.asyncio
@@ -260,22 +335,35 @@ async def test_npm_security_bulk_raises_validation_error():
 @pytest.mark.asyncio
 async def test_npm_security_bulk_file_not_found_error():
     """Test that FileNotFoundError triggers fetch from upstream."""
-    from unittest.mock import AsyncMock as AsyncMockClass
-    
     body = b'{"advisories":[]}'
-    request_mock = AsyncMockClass()
+    request_mock = AsyncMock()
     request_mock.body.return_value = body
-    
+
     # is_cache_stale returns False (cache is fresh), but conditional_file_response raises FileNotFoundError
-    # This edge case should trigger fetch from upstream
+    # This edge case should trigger fetch from upstream, then serve the fetched file
     with patch("app.routes.npm_routes.utils.is_cache_stale", return_value=False):
-        with patch("app.routes.npm_routes.utils.conditional_file_response", 
-                   side_effect=FileNotFoundError("Not found")):
-            with patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMockClass) as mock_fetch:
-                mock_fetch.return_value = {"fetched": "data"}
+        with patch("app.routes.npm_routes.utils.conditional_file_response",
+                   side_effect=[FileNotFoundError("Not found"), "fetched response"]):
+            with patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock) as mock_fetch:
                 response = await npm_routes.npm_security_bulk(request_mock)
                 mock_fetch.assert_called_once()
-                assert response == {"fetched": "data"}
+                assert mock_fetch.call_args.kwargs["data"] == body
+                assert response == "fetched response"
+
+
+@pytest.mark.asyncio
+async def test_npm_security_bulk_refetch_still_missing_is_404():
+    request_mock = AsyncMock()
+    request_mock.body.return_value = b'{"advisories":[]}'
+
+    with patch("app.routes.npm_routes.utils.is_cache_stale", return_value=False):
+        with patch("app.routes.npm_routes.utils.conditional_file_response",
+                   side_effect=FileNotFoundError("Not found")):
+            with patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock) as mock_fetch:
+                with pytest.raises(HTTPException) as exc_info:
+                    await npm_routes.npm_security_bulk(request_mock)
+                assert exc_info.value.status_code == 404
+                mock_fetch.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -312,13 +400,79 @@ async def test_npm_package_tarball_invalid_package_name():
 @patch("app.routes.npm_routes.utils.is_cache_stale", return_value=False)
 @patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
 @patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
-async def test_npm_package_tarball_fresh_cache(mock_fetch, mock_response, mock_stale):
+async def test_npm_package_tarball_fresh_cache(mock_fetch, mock_response, mock_stale, npm_cache):
     """Test that tarball fetch is skipped for fresh cache."""
     test_package = "lodash"
     tarball = "lodash-4.17.21.tgz"
+    cache_file(npm_cache / "lodash" / "-" / tarball)
+
+    mock_response.return_value = b"cached content"
+    response = await npm_routes.npm_package_tarball(test_package, tarball, request=AsyncMock())
+    mock_fetch.assert_not_called()
+    mock_response.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_npm_package_metadata_zero_ttl_never_expires(mock_fetch, mock_response, mock_stale, monkeypatch, npm_cache):
+    """A TTL of 0 treats cached metadata as immutable."""
+    monkeypatch.setattr(npm_routes.config, "NPM_METADATA_TTL_HOURS", 0)
+    cache_file(npm_cache / "lodash" / "index.json", b"{}")
 
-    with patch.object(Path, "exists", return_value=True):
-        mock_response.return_value = b"cached content"
-        response = await npm_routes.npm_package_tarball(test_package, tarball, request=AsyncMock())
-        mock_fetch.assert_not_called()
-        mock_response.assert_called_once()
+    await npm_routes.npm_package_metadata("lodash", request=AsyncMock())
+    mock_stale.assert_not_called()
+    mock_fetch.assert_not_called()
+    mock_response.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.asyncio.create_task")
+@patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_npm_package_metadata_fetch_schedules_tarball_prefetch(mock_fetch, mock_response, mock_create_task):
+    """A metadata fetch schedules a background prefetch of the latest tarball."""
+    await npm_routes.npm_package_metadata("lodash", request=AsyncMock())
+    mock_fetch.assert_called_once()
+    mock_create_task.assert_called_once()
+    # The coroutine is never run by the mock; close it to avoid a warning
+    mock_create_task.call_args.args[0].close()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.asyncio.create_task")
+@patch("app.routes.npm_routes.utils.is_cache_stale", return_value=False)
+@patch("app.routes.npm_routes.utils.conditional_file_response", new_callable=AsyncMock)
+async def test_npm_package_metadata_cached_skips_prefetch(mock_response, mock_stale, mock_create_task):
+    """Serving metadata from cache does not prefetch anything."""
+    await npm_routes.npm_package_metadata("lodash", request=AsyncMock())
+    mock_create_task.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_prefetch_latest_tarball(mock_fetch, npm_cache):
+    """The prefetch resolves dist-tags.latest and caches that version's tarball."""
+    metadata = cache_file(npm_cache / "@types" / "react" / "index.json", b"""{
+        "dist-tags": {"latest": "18.2.21"},
+        "versions": {"18.2.21": {"dist": {
+            "tarball": "https://registry.npmjs.org/@types/react/-/react-18.2.21.tgz"
+        }}}
+    }""")
+
+    await npm_routes._prefetch_latest_tarball("@types/react", metadata)
+
+    mock_fetch.assert_called_once()
+    url, dest = mock_fetch.call_args.args[:2]
+    assert url == f"{npm_routes.NPM_UPSTREAM}/%40types/react/-/react-18.2.21.tgz"
+    assert dest == (npm_cache / "@types" / "react" / "-" / "react-18.2.21.tgz").resolve()
+
+
+@pytest.mark.asyncio
+@patch("app.routes.npm_routes.utils.fetch_and_cache", new_callable=AsyncMock)
+async def test_prefetch_latest_tarball_ignores_bad_metadata(mock_fetch, npm_cache):
+    """Unparseable metadata is ignored rather than raised."""
+    metadata = cache_file(npm_cache / "lodash" / "index.json", b"not json")
+    await npm_routes._prefetch_latest_tarball("lodash", metadata)
+    mock_fetch.assert_not_called()
@@ -17,15 +17,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 from fastapi import HTTPException
 from unittest.mock import AsyncMock, patch
 from pathlib import Path
 from app.routes import pypi_routes
 
-client = AsyncMock()
-
-
 # -----------------------
 # Helper function test
 # -----------------------
@@ -45,16 +44,28 @@ def test_rewrite_index_html_relative_and_absolute():
     assert "/packages/xyz.tar.gz" in rewritten
 
 
+def test_rewrite_index_html_keeps_fragment_and_other_links():
+    html = (
+        '<a href="packages/x-1.0.tar.gz#sha256=ab">x</a>'
+        '<a href="https://example.com/docs">docs</a>'
+    )
+    rewritten = pypi_routes.rewrite_index_html(html, base_url="/pypi")
+    assert 'href="/pypi/packages/x-1.0.tar.gz#sha256=ab"' in rewritten
+    assert 'href="https://example.com/docs"' in rewritten
+
+
 # -----------------------
 # Endpoint tests
 # -----------------------
 
 @pytest.mark.asyncio
 @patch("app.routes.pypi_routes.utils.conditional_file_response", new_callable=AsyncMock)
-@patch("app.routes.pypi_routes.httpx.AsyncClient.get", new_callable=AsyncMock)
-async def test_pypi_root_index_fetch(mock_get, mock_response):
+@patch("app.routes.pypi_routes.utils.get_http_client")
+async def test_pypi_root_index_fetch(mock_get_client, mock_response):
+    mock_get = mock_get_client.return_value.get = AsyncMock()
     with patch.object(Path, "exists", return_value=False):
         mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
         mock_get.return_value.text = "<html>root index</html>"
         mock_response.return_value = b"content"
 
@@ -65,11 +76,13 @@ async def test_pypi_root_index_fetch(mock_get, mock_response):
 
 @pytest.mark.asyncio
 @patch("app.routes.pypi_routes.utils.conditional_file_response", new_callable=AsyncMock)
-@patch("app.routes.pypi_routes.httpx.AsyncClient.get", new_callable=AsyncMock)
-async def test_pypi_package_index_fetch(mock_get, mock_response):
+@patch("app.routes.pypi_routes.utils.get_http_client")
+async def test_pypi_package_index_fetch(mock_get_client, mock_response):
     package = "example"
+    mock_get = mock_get_client.return_value.get = AsyncMock()
     with patch.object(Path, "exists", return_value=False):
         mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
         mock_get.return_value.text = "<html><a href='packages/foo.whl'></a></html>"
         mock_response.return_value = b"content"
 
@@ -166,17 +179,16 @@ async def test_pypi_package_json_rejects_traversal():
 @pytest.mark.asyncio
 @patch("app.routes.pypi_routes.utils.is_cache_stale", return_value=True)
 @patch("app.routes.pypi_routes.utils.conditional_file_response", new_callable=AsyncMock)
-@patch("app.routes.pypi_routes.httpx.AsyncClient")
-async def test_pypi_root_index_stale_refresh(mock_client_cls, mock_response, mock_stale):
+@patch("app.routes.pypi_routes.utils.get_http_client")
+async def test_pypi_root_index_stale_refresh(mock_get_client, mock_response, mock_stale):
     """Test that stale PyPI root index is refreshed."""
     mock_client = AsyncMock()
     mock_get_resp = AsyncMock()
     mock_get_resp.status_code = 200
+    mock_get_resp.headers = {}
     mock_get_resp.text = "<html>root</html>"
     mock_client.get = AsyncMock(return_value=mock_get_resp)
-    mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-    mock_client.__aexit__ = AsyncMock(return_value=None)
-    mock_client_cls.return_value = mock_client
+    mock_get_client.return_value = mock_client
     
     mock_response.return_value = b"content"
     request_mock = AsyncMock()
@@ -187,6 +199,87 @@ async def test_pypi_root_index_stale_refresh(mock_client_cls, mock_response, moc
         mock_response.assert_called_once()
 
 
+@pytest.mark.asyncio
+@patch("app.routes.pypi_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.pypi_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.pypi_routes.utils.get_http_client")
+async def test_pypi_package_index_unchanged_upstream_skips_rewrite(
+    mock_get_client, mock_response, mock_stale, tmp_path, monkeypatch
+):
+    """A stale refresh returning the same body reuses the rewritten file."""
+    monkeypatch.setattr(pypi_routes, "PYPI_CACHE", tmp_path)
+    monkeypatch.setattr(pypi_routes, "_INDEX_DIGESTS", {})
+    mock_get = mock_get_client.return_value.get = AsyncMock()
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.headers = {}
+    mock_get.return_value.text = "<html><a href='packages/foo.whl'></a></html>"
+    request_mock = AsyncMock()
+
+    with patch.object(pypi_routes, "rewrite_index_html",
+                      wraps=pypi_routes.rewrite_index_html) as mock_rewrite:
+        await pypi_routes.pypi_package_index("example", request_mock)
+        await pypi_routes.pypi_package_index("example", request_mock)
+
+    assert mock_get.await_count == 2
+    mock_rewrite.assert_called_once()
+    assert (tmp_path / "simple" / "example" / "index.html").exists()
+
+
+def test_write_index_replaces_file_atomically(tmp_path, monkeypatch):
+    """A refresh swaps in a new file; readers of the old page are unaffected."""
+    monkeypatch.setattr(pypi_routes, "_INDEX_DIGESTS", {})
+    local_path = tmp_path / "simple" / "example" / "index.html"
+    pypi_routes.write_index(local_path, "<html>old page</html>", rewrite=False)
+
+    with open(local_path, "rb") as reader:
+        pypi_routes.write_index(local_path, "<html>new</html>", rewrite=False)
+        assert reader.read() == b"<html>old page</html>"
+    assert local_path.read_text() == "<html>new</html>"
+    assert os.listdir(local_path.parent) == ["index.html"]
+
+
+def test_write_index_digest_eviction_is_thread_safe(tmp_path, monkeypatch):
+    monkeypatch.setattr(pypi_routes, "_INDEX_DIGESTS", {})
+    monkeypatch.setattr(pypi_routes, "_INDEX_DIGESTS_MAX", 2)
+    paths = [tmp_path / f"pkg{i}" / "index.html" for i in range(32)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda p: pypi_routes.write_index(p, p.parent.name, rewrite=False), paths))
+
+    assert len(pypi_routes._INDEX_DIGESTS) <= 2
+
+
+@pytest.mark.asyncio
+@patch("app.routes.pypi_routes.utils.is_cache_stale", return_value=True)
+@patch("app.routes.pypi_routes.utils.conditional_file_response", new_callable=AsyncMock)
+@patch("app.routes.pypi_routes.utils.get_http_client")
+async def test_pypi_package_index_revalidates_with_upstream_etag(
+    mock_get_client, mock_response, mock_stale, tmp_path, monkeypatch
+):
+    """A stale index is revalidated with If-None-Match; 304 keeps the file."""
+    monkeypatch.setattr(pypi_routes, "PYPI_CACHE", tmp_path)
+    monkeypatch.setattr(pypi_routes, "_INDEX_DIGESTS", {})
+    mock_get = mock_get_client.return_value.get = AsyncMock()
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.headers = {"etag": '"abc"'}
+    mock_get.return_value.text = "<html><a href='packages/foo.whl'></a></html>"
+    request_mock = AsyncMock()
+
+    await pypi_routes.pypi_package_index("example", request_mock)
+    local_path = tmp_path / "simple" / "example" / "index.html"
+    body = local_path.read_bytes()
+    os.utime(local_path, (0, 0))
+
+    mock_get.return_value.status_code = 304
+    with patch.object(pypi_routes, "rewrite_index_html") as mock_rewrite:
+        await pypi_routes.pypi_package_index("example", request_mock)
+
+    assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": '"abc"'}
+    mock_rewrite.assert_not_called()
+    assert local_path.read_bytes() == body
+    assert local_path.stat().st_mtime > 0
+
+
 @pytest.mark.asyncio
 @patch("app.routes.pypi_routes.utils.is_cache_stale", return_value=False)
 @patch("app.routes.pypi_routes.utils.conditional_file_response", new_callable=AsyncMock)
@@ -240,16 +333,15 @@ async def test_pypi_package_index_raises_validation_error():
 
 @pytest.mark.asyncio
 async def test_pypi_artifact_raises_validation_error():
-    """Test that ValidationError from safe_join_path raises HTTPException(400)."""
+    """Test that ValidationError from safe_cache_path raises HTTPException(400)."""
     from app.validators import ValidationError
     
-    with patch("app.routes.pypi_routes.safe_join_path", 
+    with patch("app.routes.pypi_routes.utils.safe_cache_path", 
                side_effect=ValidationError("Invalid path")):
         request_mock = AsyncMock()
         with pytest.raises(HTTPException) as exc_info:
             await pypi_routes.pypi_artifact("requests/file.whl", request_mock)
-        # PyPI routes call httpx to fetch, which may result in 404
-        assert exc_info.value.status_code in (400, 404)
+        assert exc_info.value.status_code == 400
 
 
 @pytest.mark.asyncio
@@ -19,12 +19,19 @@
 
 
 import pytest
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
+from types import SimpleNamespace
+from email.utils import parsedate_to_datetime
 # from pathlib import Path
+import asyncio
+import gzip
+from collections import OrderedDict
 import json
+import ssl
+import certifi
 # import os
 # from datetime import datetime
-from fastapi.responses import Response
+from fastapi.responses import FileResponse
 import app.utils as utils
 from http import HTTPMethod
 
@@ -55,6 +62,24 @@ def test_safe_cache_path_rejects_absolute(tmp_path):
         utils.safe_cache_path(tmp_path, "/etc/passwd")
 
 
+def test_resolved_root_follows_symlink_and_is_cached(tmp_path):
+    target = tmp_path / "real"
+    target.mkdir()
+    link = tmp_path / "link"
+    link.symlink_to(target)
+    assert utils.resolved_root(link) == target.resolve()
+    assert utils.resolved_root(link) is utils.resolved_root(link)
+
+
+def test_safe_cache_path_rejects_symlink_escape(tmp_path):
+    root = tmp_path / "cache"
+    root.mkdir()
+    (tmp_path / "cache2").mkdir()
+    (root / "link").symlink_to(tmp_path / "cache2")
+    with pytest.raises(ValueError):
+        utils.safe_cache_path(root, "link", "file.txt")
+
+
 # ------------------------
 # open_cached_file
 # ------------------------
@@ -74,23 +99,58 @@ def test_open_cached_file(tmp_path):
 # make_etag_and_last_modified
 # ------------------------
 
-def test_make_etag_and_last_modified(tmp_path):
-    file_path = tmp_path / "file.txt"
-    file_path.write_text("abc")
-    etag, last_modified = utils.make_etag_and_last_modified(file_path)
+def test_make_etag_and_last_modified(abc_file):
+    etag, last_modified = utils.make_etag_and_last_modified(abc_file)
     assert isinstance(etag, str)
     assert isinstance(last_modified, str)
-    assert len(etag) == 64  # sha256 hash length
+    assert len(etag) == utils.ETAG_HEX_LEN
+
+
+def test_last_modified_is_rfc_1123_gmt(abc_file):
+    _, last_modified = utils.make_etag_and_last_modified(abc_file)
+    mtime = int(abc_file.stat().st_mtime)
+    assert last_modified == utils._http_date(mtime)
+    assert last_modified.endswith(" GMT")
+    assert parsedate_to_datetime(last_modified).timestamp() == mtime
+
+
+def test_make_etag_and_last_modified_is_memoized(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_ETAG_CACHE", OrderedDict())
+    file_path = tmp_path / "file.txt"
+    file_path.write_text("abc")
+
+    first = utils.make_etag_and_last_modified(file_path)
+    with patch.object(utils.hashlib, "blake2b") as mock_hash:
+        assert utils.make_etag_and_last_modified(file_path) == first
+        mock_hash.assert_not_called()
+
+    # A changed file gets a new key and a new ETag
+    file_path.write_text("abcd")
+    assert utils.make_etag_and_last_modified(file_path)[0] != first[0]
+    assert len(utils._ETAG_CACHE) == 2
+
+
+def test_etag_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_ETAG_CACHE", OrderedDict())
+    monkeypatch.setattr(utils, "_ETAG_CACHE_MAX", 2)
+    a, b, c = (tmp_path / name for name in ("a", "b", "c"))
+    for f in (a, b, c):
+        f.write_text(f.name)
+
+    utils.make_etag_and_last_modified(a)
+    utils.make_etag_and_last_modified(b)
+    utils.make_etag_and_last_modified(a)  # a is now most recently used
+    utils.make_etag_and_last_modified(c)  # evicts b
+
+    assert [key[0] for key in utils._ETAG_CACHE] == [str(a), str(c)]
 
 
 # ------------------------
 # file_headers
 # ------------------------
 
-def test_file_headers(tmp_path):
-    file_path = tmp_path / "file.txt"
-    file_path.write_text("abc")
-    headers = utils.file_headers(file_path)
+def test_file_headers(abc_file):
+    headers = utils.file_headers(abc_file)
     assert "ETag" in headers
     assert "Last-Modified" in headers
 
@@ -99,45 +159,133 @@ def test_file_headers(tmp_path):
 # conditional_file_response
 # ------------------------
 
-@pytest.mark.asyncio
-async def test_conditional_file_response_returns_content(tmp_path):
-    file_path = tmp_path / "file.txt"
-    file_path.write_text("abc")
+async def _served(response, headers=None) -> tuple[int, dict, bytes]:
+    """Run ``response`` as an ASGI app for a GET; return status, headers, body."""
+    start = {}
+    chunks = []
 
-    request = MagicMock()
-    request.headers = {}
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
 
-    response = await utils.conditional_file_response(request, file_path, "text/plain")
-    assert isinstance(response, Response)
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    scope = {"type": "http", "method": "GET", "headers": raw}
+    await response(scope, receive, send)
+    sent_headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return start["status"], sent_headers, b"".join(chunks)
+
+
+async def _served_body(response, headers=None) -> bytes:
+    """Run ``response`` as an ASGI app for a GET and collect the body bytes."""
+    return (await _served(response, headers))[2]
+
+
+@pytest.fixture(scope="module")
+def etag_pair(abc_file):
+    """The shared file with its ETag and Last-Modified, computed once per module."""
+    return abc_file, *utils.make_etag_and_last_modified(abc_file)
+
+
+@pytest.mark.asyncio
+async def test_conditional_file_response_returns_content(abc_file, monkeypatch):
+    monkeypatch.setattr(utils.config, "CACHE_DIR", abc_file.parent)
+    request = SimpleNamespace(headers={})
+
+    response = await utils.conditional_file_response(request, abc_file, "text/plain")
+    assert isinstance(response, FileResponse)
     assert response.status_code == 200
-    assert response.body == b"abc"
+    assert await _served_body(response) == b"abc"
     assert "ETag" in response.headers
     assert "Last-Modified" in response.headers
 
 
 @pytest.mark.asyncio
-async def test_conditional_file_response_304(tmp_path):
-    file_path = tmp_path / "file.txt"
-    file_path.write_text("abc")
-
-    etag, last_modified = utils.make_etag_and_last_modified(file_path)
+async def test_conditional_file_response_304(etag_pair, monkeypatch):
+    file_path, etag, last_modified = etag_pair
+    monkeypatch.setattr(utils.config, "CACHE_DIR", file_path.parent)
 
-    request = MagicMock()
-    request.headers = {"If-None-Match": etag}
+    request = SimpleNamespace(headers={"If-None-Match": etag})
     response = await utils.conditional_file_response(request, file_path, "text/plain")
     assert response.status_code == 304
+    st = file_path.stat()
+    assert utils._ETAG_CACHE[(str(file_path), st.st_mtime_ns, st.st_size)] == (etag, last_modified)
+    assert response.headers["ETag"] == etag
+    assert response.headers["Last-Modified"] == last_modified
+    assert response.headers["Cache-Control"] == utils.REVALIDATE_CACHE_CONTROL
 
     request.headers = {"If-Modified-Since": last_modified}
     response = await utils.conditional_file_response(request, file_path, "text/plain")
     assert response.status_code == 304
 
 
+@pytest.mark.asyncio
+async def test_conditional_file_response_stats_file_once(abc_file, monkeypatch):
+    monkeypatch.setattr(utils.config, "CACHE_DIR", abc_file.parent)
+    real_stat = utils.os.stat
+    calls = []
+
+    def counting_stat(path, *args, **kwargs):
+        calls.append(path)
+        return real_stat(path, *args, **kwargs)
+
+    request = SimpleNamespace(headers={})
+    response = await utils.conditional_file_response(request, abc_file, "text/plain")
+    monkeypatch.setattr(utils.os, "stat", counting_stat)
+    status, headers, body = await _served(response)
+    assert (status, body) == (200, b"abc")
+    assert headers["content-length"] == "3"
+    assert calls == []  # FileResponse reused the handler's stat result
+
+
+@pytest.mark.asyncio
+async def test_conditional_file_response_rejects_directory(tmp_path):
+    (tmp_path / "subdir").mkdir()
+    request = SimpleNamespace(headers={})
+    with pytest.raises(FileNotFoundError):
+        await utils.conditional_file_response(request, tmp_path / "subdir", "text/plain")
+
+
+@pytest.mark.asyncio
+async def test_conditional_file_response_range(tmp_path):
+    """Range requests get a 206 with just the requested bytes."""
+    file_path = tmp_path / "file.txt"
+    file_path.write_text("abcdef")
+    request = SimpleNamespace(headers={})
+
+    response = await utils.conditional_file_response(request, file_path, "text/plain")
+    status, headers, body = await _served(response, {"Range": "bytes=0-1"})
+    assert status == 206
+    assert body == b"ab"
+    assert headers["content-range"] == "bytes 0-1/6"
+
+    status, headers, body = await _served(response)
+    assert status == 200
+    assert body == b"abcdef"
+    assert headers["accept-ranges"] == "bytes"
+
+
+@pytest.mark.asyncio
+async def test_conditional_file_response_immutable_cache_control(tmp_path):
+    file_path = tmp_path / "pkg-1.0.tgz"
+    file_path.write_bytes(b"tgz")
+    request = SimpleNamespace(headers={})
+
+    response = await utils.conditional_file_response(
+        request, file_path, "application/octet-stream", immutable=True
+    )
+    assert response.headers["Cache-Control"] == utils.IMMUTABLE_CACHE_CONTROL
+
+
 @pytest.mark.asyncio
 async def test_conditional_file_response_rejects_outside_cache(tmp_path):
     file_path = tmp_path.parent / "outside.txt"
     file_path.write_text("abc")
-    request = MagicMock()
-    request.headers = {}
+    request = SimpleNamespace(headers={})
     with pytest.raises(FileNotFoundError):
         await utils.conditional_file_response(request, file_path, "text/plain")
 
@@ -146,6 +294,17 @@ async def test_conditional_file_response_rejects_outside_cache(tmp_path):
 # fetch_and_cache
 # ------------------------
 
+def _streaming(resp, body: bytes):
+    """Stand-in for ``client.stream`` yielding ``resp`` with ``body``."""
+    async def aiter_bytes(*_):
+        yield body
+    resp.aiter_bytes = aiter_bytes
+    stream_ctx = MagicMock()
+    stream_ctx.__aenter__ = AsyncMock(return_value=resp)
+    stream_ctx.__aexit__ = AsyncMock(return_value=False)
+    return MagicMock(return_value=stream_ctx)
+
+
 @pytest.mark.asyncio
 async def test_fetch_and_cache_get_bytes(monkeypatch, tmp_path):
     """Simulate GET fetch with byte content"""
@@ -154,17 +313,19 @@ async def test_fetch_and_cache_get_bytes(monkeypatch, tmp_path):
 
     mock_client = AsyncMock()
     mock_resp = MagicMock()
+    mock_resp.headers = {}
     mock_resp.status_code = 200
     mock_resp.content = b"abc"
     mock_resp.text = "abc"
     mock_resp.raise_for_status = MagicMock()
-    mock_client.__aenter__.return_value = mock_client
-    mock_client.get.return_value = mock_resp
-    monkeypatch.setattr(utils.httpx, "AsyncClient", lambda **_: mock_client)
+    mock_client.stream = _streaming(mock_resp, b"abc")
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
 
     result = await utils.fetch_and_cache(url, dest)
+    mock_client.stream.assert_called_once_with("GET", url, headers={}, timeout=60.0)
     assert dest.exists()
     assert dest.read_bytes() == b"abc"
+    assert list(tmp_path.iterdir()) == [dest]
     assert result == dest
 
 
@@ -177,13 +338,13 @@ async def test_fetch_and_cache_post_json(monkeypatch, tmp_path):
 
     mock_client = AsyncMock()
     mock_resp = MagicMock()
+    mock_resp.headers = {}
     mock_resp.status_code = 200
     mock_resp.text = '{"ok":true}'
     mock_resp.content = b'{"ok":true}'
     mock_resp.raise_for_status = MagicMock()
-    mock_client.__aenter__.return_value = mock_client
     mock_client.post.return_value = mock_resp
-    monkeypatch.setattr(utils.httpx, "AsyncClient", lambda **_: mock_client)
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
 
     result = await utils.fetch_and_cache(
         url, dest, method=HTTPMethod.POST, data=data, return_json=True
@@ -203,19 +364,185 @@ async def test_fetch_and_cache_raises_http_exception(monkeypatch, tmp_path):
 
     mock_client = AsyncMock()
     mock_resp = MagicMock()
+    mock_resp.headers = {}
     mock_resp.status_code = 404
     mock_resp.raise_for_status.side_effect = utils.httpx.HTTPStatusError(
         "Not Found", request=None, response=mock_resp
     )
-    mock_client.__aenter__.return_value = mock_client
-    mock_client.get.return_value = mock_resp
-    monkeypatch.setattr(utils.httpx, "AsyncClient", lambda **_: mock_client)
+    mock_client.stream = _streaming(mock_resp, b"")
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
 
     with pytest.raises(utils.HTTPException) as exc:
         await utils.fetch_and_cache(url, dest)
     assert exc.value.status_code == 404
 
 
+@pytest.mark.asyncio
+async def test_fetch_and_cache_refresh_revalidates_with_saved_etag(monkeypatch, tmp_path):
+    """A forced refresh sends the saved validators; a 304 keeps the cached body."""
+    url = "http://example.com/pkg"
+    dest = tmp_path / "pkg.json"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.headers = {"etag": 'W/"1"', "last-modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, b"v1")
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    await utils.fetch_and_cache(url, dest, save_validators=True)
+    assert utils.validators_sidecar_path(dest).exists()
+
+    mock_resp.status_code = 304
+    await utils.fetch_and_cache(url, dest, force_refresh=True, save_validators=True)
+    assert mock_client.stream.call_args.kwargs["headers"] == {
+        "If-None-Match": 'W/"1"',
+        "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+    }
+    assert dest.read_bytes() == b"v1"
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_skips_validators_by_default(monkeypatch, tmp_path):
+    """Immutable artifacts are never revalidated, so nothing is recorded for them."""
+    dest = tmp_path / "pkg-1.0.jar"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.headers = {"etag": '"1"'}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, b"jar")
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    await utils.fetch_and_cache("http://example.com/pkg-1.0.jar", dest)
+    assert not utils.validators_sidecar_path(dest).exists()
+
+
+@pytest.mark.asyncio
+async def test_conditional_file_response_refuses_sidecars(tmp_path):
+    dest = tmp_path / "index.json"
+    dest.write_bytes(b"{}")
+    utils._write_gzip_sidecar(dest)
+    utils.validators_sidecar_path(dest).write_text('"1"\n\n')
+
+    request = SimpleNamespace(headers={})
+    for sidecar in (utils.gzip_sidecar_path(dest), utils.validators_sidecar_path(dest)):
+        with pytest.raises(FileNotFoundError):
+            await utils.conditional_file_response(request, sidecar, "application/octet-stream")
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_coalesces_concurrent_fetches(monkeypatch, tmp_path):
+    """Parallel misses for the same dest share one upstream download."""
+    url = "http://example.com/pkg.whl"
+    dest = tmp_path / "pkg.whl"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.headers = {}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, b"wheel")
+
+    async def slow_aiter_bytes(*_):
+        await asyncio.sleep(0.01)
+        yield b"wheel"
+    mock_resp.aiter_bytes = slow_aiter_bytes
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    results = await asyncio.gather(
+        *(utils.fetch_and_cache(url, dest) for _ in range(10))
+    )
+    assert mock_client.stream.call_count == 1
+    assert results == [dest] * 10
+    assert dest.read_bytes() == b"wheel"
+    assert utils._INFLIGHT == {}
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_waiter_survives_cancelled_leader(monkeypatch, tmp_path):
+    """Cancelling the fetching request hands the download to a waiter."""
+    url = "http://example.com/pkg.whl"
+    dest = tmp_path / "pkg.whl"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.headers = {}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, b"wheel")
+
+    async def slow_aiter_bytes(*_):
+        await asyncio.sleep(0.05)
+        yield b"wheel"
+    mock_resp.aiter_bytes = slow_aiter_bytes
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    leader = asyncio.create_task(utils.fetch_and_cache(url, dest))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(utils.fetch_and_cache(url, dest))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    assert await waiter == dest
+    assert leader.cancelled()
+    assert mock_client.stream.call_count == 2
+    assert dest.read_bytes() == b"wheel"
+    assert utils._INFLIGHT == {}
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_cancelled_waiter_does_not_cancel_fetch(monkeypatch, tmp_path):
+    url = "http://example.com/pkg.whl"
+    dest = tmp_path / "pkg.whl"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.headers = {}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, b"wheel")
+
+    async def slow_aiter_bytes(*_):
+        await asyncio.sleep(0.05)
+        yield b"wheel"
+    mock_resp.aiter_bytes = slow_aiter_bytes
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    leader = asyncio.create_task(utils.fetch_and_cache(url, dest))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(utils.fetch_and_cache(url, dest))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+
+    assert await leader == dest
+    assert waiter.cancelled()
+    assert mock_client.stream.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_coalesced_waiters_share_upstream_error(monkeypatch, tmp_path):
+    dest = tmp_path / "missing.whl"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.headers = {}
+    mock_resp.status_code = 404
+
+    async def slow_raise():
+        await asyncio.sleep(0.01)
+        raise utils.httpx.HTTPStatusError("Not Found", request=None, response=mock_resp)
+    mock_client.stream = _streaming(mock_resp, b"")
+    mock_client.stream.return_value.__aenter__.side_effect = slow_raise
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    results = await asyncio.gather(
+        *(utils.fetch_and_cache("http://example.com/missing.whl", dest) for _ in range(3)),
+        return_exceptions=True,
+    )
+    assert mock_client.stream.call_count == 1
+    assert all(isinstance(r, utils.HTTPException) and r.status_code == 404 for r in results)
+
+
 # ------------------------
 # Additional safety checks
 # ------------------------
@@ -225,8 +552,7 @@ async def test_fetch_and_cache_refuses_outside_cache(monkeypatch, tmp_path):
     """Destination outside cache should raise HTTPException(400)."""
     outside = tmp_path.parent / "escape.txt"
     mock_client = AsyncMock()
-    mock_client.__aenter__.return_value = mock_client
-    monkeypatch.setattr(utils.httpx, "AsyncClient", lambda **_: mock_client)
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
 
     with pytest.raises(utils.HTTPException) as exc:
         await utils.fetch_and_cache("http://example.com", outside)
@@ -310,8 +636,7 @@ async def test_fetch_and_cache_returns_existing_file_json(monkeypatch, tmp_path)
 async def test_conditional_file_response_not_found(tmp_path):
     """Test that conditional_file_response raises FileNotFoundError for missing files."""
     file_path = tmp_path / "missing.txt"
-    request = MagicMock()
-    request.headers = {}
+    request = SimpleNamespace(headers={})
     
     with pytest.raises(FileNotFoundError):
         await utils.conditional_file_response(request, file_path, "text/plain")
@@ -323,8 +648,7 @@ async def test_conditional_file_response_with_attachment(tmp_path):
     file_path = tmp_path / "file.bin"
     file_path.write_bytes(b"binary data")
     
-    request = MagicMock()
-    request.headers = {}
+    request = SimpleNamespace(headers={})
     
     response = await utils.conditional_file_response(
         request, file_path, "application/octet-stream", attachment=True
@@ -342,8 +666,7 @@ async def test_conditional_file_response_if_none_match_case_insensitive(tmp_path
     
     etag, _ = utils.make_etag_and_last_modified(file_path)
     
-    request = MagicMock()
-    request.headers = {"if-none-match": etag}
+    request = SimpleNamespace(headers={"if-none-match": etag})
     
     response = await utils.conditional_file_response(request, file_path, "text/plain")
     assert response.status_code == 304
@@ -357,8 +680,7 @@ async def test_conditional_file_response_if_modified_since_case_insensitive(tmp_
     
     _, last_modified = utils.make_etag_and_last_modified(file_path)
     
-    request = MagicMock()
-    request.headers = {"if-modified-since": last_modified}
+    request = SimpleNamespace(headers={"if-modified-since": last_modified})
     
     response = await utils.conditional_file_response(request, file_path, "text/plain")
     assert response.status_code == 304
@@ -372,12 +694,12 @@ async def test_fetch_and_cache_post_without_json(monkeypatch, tmp_path):
     
     mock_client = AsyncMock()
     mock_resp = MagicMock()
+    mock_resp.headers = {}
     mock_resp.status_code = 200
     mock_resp.content = b"binary result"
     mock_resp.raise_for_status = MagicMock()
-    mock_client.__aenter__.return_value = mock_client
     mock_client.post.return_value = mock_resp
-    monkeypatch.setattr(utils.httpx, "AsyncClient", lambda **_: mock_client)
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
     
     result = await utils.fetch_and_cache(
         url, dest, method=HTTPMethod.POST, data=b"request data", return_json=False
@@ -389,27 +711,21 @@ async def test_fetch_and_cache_post_without_json(monkeypatch, tmp_path):
 
 @pytest.mark.asyncio
 async def test_fetch_and_cache_timeout_parameter(monkeypatch, tmp_path):
-    """Test that timeout parameter is passed to AsyncClient."""
+    """Test that timeout parameter is passed to the upstream request."""
     url = "http://example.com/data.txt"
     dest = tmp_path / "data.txt"
     
     mock_client = AsyncMock()
     mock_resp = MagicMock()
+    mock_resp.headers = {}
     mock_resp.status_code = 200
     mock_resp.content = b"data"
     mock_resp.raise_for_status = MagicMock()
-    mock_client.__aenter__.return_value = mock_client
-    mock_client.get.return_value = mock_resp
-    
-    client_init_args = {}
-    def mock_client_init(**kwargs):
-        client_init_args.update(kwargs)
-        return mock_client
-    
-    monkeypatch.setattr(utils.httpx, "AsyncClient", mock_client_init)
+    mock_client.stream = _streaming(mock_resp, b"data")
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
     
     await utils.fetch_and_cache(url, dest, timeout=120.0)
-    assert client_init_args.get("timeout") == 120.0
+    assert mock_client.stream.call_args.kwargs["timeout"] == 120.0
 
 
 def test_safe_cache_path_multiple_absolute_attempts(tmp_path):
@@ -427,13 +743,168 @@ async def test_conditional_file_response_case_insensitive_headers(tmp_path):
     etag, last_modified = utils.make_etag_and_last_modified(file_path)
     
     # Test with uppercase If-None-Match
-    request = MagicMock()
-    request.headers = {"If-None-Match": etag}
+    request = SimpleNamespace(headers={"If-None-Match": etag})
     response = await utils.conditional_file_response(request, file_path, "text/plain")
     assert response.status_code == 304
     
     # Test with uppercase If-Modified-Since
-    request = MagicMock()
-    request.headers = {"If-Modified-Since": last_modified}
+    request = SimpleNamespace(headers={"If-Modified-Since": last_modified})
     response = await utils.conditional_file_response(request, file_path, "text/plain")
     assert response.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_json_gzip_sidecar_round_trip(monkeypatch, tmp_path):
+    """JSON responses get a gzip sidecar that is served to gzip-capable clients."""
+    url = "http://example.com/pkg"
+    dest = tmp_path / "index.json"
+    payload = b'{"name": "pkg", "versions": {}}'
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.content = payload
+    mock_resp.headers = {"content-type": "application/json; charset=utf-8"}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, payload)
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    await utils.fetch_and_cache(url, dest)
+    sidecar = utils.gzip_sidecar_path(dest)
+    assert sidecar.exists()
+    assert gzip.decompress(sidecar.read_bytes()) == payload
+
+    request = SimpleNamespace(headers={"accept-encoding": "gzip, deflate"})
+    response = await utils.conditional_file_response(request, dest, "application/json")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(await _served_body(response)) == payload
+
+    request.headers = {}
+    response = await utils.conditional_file_response(request, dest, "application/json")
+    assert "Content-Encoding" not in response.headers
+    assert await _served_body(response) == payload
+
+
+@pytest.mark.asyncio
+async def test_gzip_sidecar_has_its_own_etag(tmp_path):
+    """The gzip and identity codings are distinct representations."""
+    dest = tmp_path / "index.json"
+    dest.write_bytes(b'{"name": "pkg"}')
+    utils._write_gzip_sidecar(dest)
+    etag, _ = utils.make_etag_and_last_modified(dest)
+    gzip_etag = etag + utils.GZIP_ETAG_SUFFIX
+
+    gzip_request = SimpleNamespace(headers={"accept-encoding": "gzip"})
+    response = await utils.conditional_file_response(gzip_request, dest, "application/json")
+    assert response.headers["ETag"] == gzip_etag
+    response = await utils.conditional_file_response(
+        SimpleNamespace(headers={}), dest, "application/json"
+    )
+    assert response.headers["ETag"] == etag
+
+    # A resume whose If-Range carries the identity ETag must not get gzip bytes
+    response = await utils.conditional_file_response(gzip_request, dest, "application/json")
+    status, _, body = await _served(response, {"Range": "bytes=0-3", "If-Range": etag})
+    assert status == 200
+    assert gzip.decompress(body) == b'{"name": "pkg"}'
+
+    # Either ETag revalidates; the 304 echoes the one the client holds
+    for held in (etag, gzip_etag):
+        request = SimpleNamespace(headers={"accept-encoding": "gzip", "if-none-match": held})
+        response = await utils.conditional_file_response(request, dest, "application/json")
+        assert response.status_code == 304
+        assert response.headers["ETag"] == held
+        assert response.headers["Vary"] == "Accept-Encoding"
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_cache_non_json_has_no_sidecar(monkeypatch, tmp_path):
+    """Binary artifacts are not precompressed."""
+    dest = tmp_path / "file.tgz"
+
+    mock_client = AsyncMock()
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.content = b"\x1f\x8b binary"
+    mock_resp.headers = {"content-type": "application/octet-stream"}
+    mock_resp.raise_for_status = MagicMock()
+    mock_client.stream = _streaming(mock_resp, b"\x1f\x8b binary")
+    monkeypatch.setattr(utils, "get_http_client", lambda: mock_client)
+
+    await utils.fetch_and_cache("http://example.com/file.tgz", dest)
+    assert not utils.gzip_sidecar_path(dest).exists()
+
+
+def test_shared_client_uses_prebuilt_ssl_context(monkeypatch):
+    """The shared client reuses the SSL context built at import time."""
+    client_init_args = {}
+
+    def mock_client_init(**kwargs):
+        client_init_args.update(kwargs)
+        return MagicMock(is_closed=False)
+
+    monkeypatch.setattr(utils, "_http_client", None)
+    monkeypatch.setattr(utils.httpx, "AsyncClient", mock_client_init)
+
+    utils.get_http_client()
+    assert isinstance(utils._SSL_CONTEXT, ssl.SSLContext)
+    assert client_init_args["verify"] is utils._SSL_CONTEXT
+    assert client_init_args["http2"] is True
+
+
+def test_shared_client_pool_follows_config(monkeypatch):
+    client_init_args = {}
+
+    def mock_client_init(**kwargs):
+        client_init_args.update(kwargs)
+        return MagicMock(is_closed=False)
+
+    monkeypatch.setattr(utils, "_http_client", None)
+    monkeypatch.setattr(utils.httpx, "AsyncClient", mock_client_init)
+    monkeypatch.setattr(utils.config, "HTTP2_ENABLED", False)
+    monkeypatch.setattr(utils.config, "REQUEST_TIMEOUT_SECONDS", 45)
+    monkeypatch.setattr(utils.config, "HTTP_MAX_CONNECTIONS", 300)
+    monkeypatch.setattr(utils.config, "HTTP_MAX_KEEPALIVE_CONNECTIONS", 150)
+
+    utils.get_http_client()
+    assert client_init_args["http2"] is False
+    assert client_init_args["timeout"].read == 45
+    assert client_init_args["timeout"].connect == 5.0
+    limits = client_init_args["limits"]
+    assert (limits.max_connections, limits.max_keepalive_connections) == (300, 150)
+
+
+def test_ssl_context_loads_extra_ca_file(monkeypatch):
+    monkeypatch.setattr(utils.config, "SSL_CA_FILE", certifi.where())
+    context = utils._make_ssl_context()
+    assert context.cert_store_stats()["x509_ca"] > 0
+
+
+def test_ssl_context_honours_ssl_cert_file(monkeypatch, tmp_path):
+    """SSL_CERT_FILE replaces certifi's bundle, as it does for plain httpx."""
+    bundle = open(certifi.where(), encoding="ascii").read()
+    end = "-----END CERTIFICATE-----"
+    one_ca = tmp_path / "ca.pem"
+    one_ca.write_text(bundle[bundle.index("-----BEGIN CERTIFICATE-----"):bundle.index(end) + len(end)])
+    monkeypatch.setenv("SSL_CERT_FILE", str(one_ca))
+    monkeypatch.setattr(utils.config, "SSL_CA_FILE", None)
+
+    context = utils._make_ssl_context()
+    assert context.cert_store_stats()["x509_ca"] == 1
+
+
+def test_default_backend_uses_httpx_transport(monkeypatch):
+    monkeypatch.setattr(utils.config, "HTTP_BACKEND", "httpx")
+    assert utils._make_transport() is None
+
+
+@pytest.mark.asyncio
+async def test_aiohttp_backend_transport(monkeypatch):
+    """HTTP_BACKEND=aiohttp keeps the httpx API but runs over aiohttp."""
+    from httpx_aiohttp import AiohttpTransport
+
+    monkeypatch.setattr(utils.config, "HTTP_BACKEND", "aiohttp")
+    transport = utils._make_transport()
+    assert isinstance(transport, AiohttpTransport)
+    await transport.aclose()
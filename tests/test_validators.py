@@ -21,6 +21,7 @@ import pytest
 from app.validators import (
     validate_npm_package_name,
     validate_pypi_package_name,
+    validate_pypi_artifact_path,
     validate_maven_path,
     validate_version_string,
     safe_join_path,
@@ -43,6 +44,7 @@ class TestNPMValidation:
         assert not validate_npm_package_name("..\\windows\\system32")
         assert not validate_npm_package_name("")
         assert not validate_npm_package_name("a" * 215)  # Too long
+        assert not validate_npm_package_name("lodash\n")
 
 
 class TestPyPIValidation:
@@ -57,6 +59,24 @@ class TestPyPIValidation:
         assert not validate_pypi_package_name("/etc/passwd")
         assert not validate_pypi_package_name("package\0name")
         assert not validate_pypi_package_name("")
+        assert not validate_pypi_package_name("requests\n")
+        assert not validate_pypi_package_name("a" * 215)
+
+    def test_valid_pypi_artifact_paths(self):
+        assert validate_pypi_artifact_path(
+            "ab/cd/0123abcd/requests-2.31.0-py3-none-any.whl")
+        assert validate_pypi_artifact_path("packages/x/torch-2.1.0+cpu-cp311-cp311-linux_x86_64.whl")
+        assert validate_pypi_artifact_path("somepackage/file.whl")
+
+    def test_invalid_pypi_artifact_paths(self):
+        assert not validate_pypi_artifact_path("../secret/file.whl")
+        assert not validate_pypi_artifact_path("a/../../b.whl")
+        assert not validate_pypi_artifact_path("a/./b.whl")
+        assert not validate_pypi_artifact_path("/etc/passwd")
+        assert not validate_pypi_artifact_path("a//b.whl")
+        assert not validate_pypi_artifact_path("a\\b.whl")
+        assert not validate_pypi_artifact_path("a/b.whl\0")
+        assert not validate_pypi_artifact_path("")
 
 
 class TestMavenValidation:
@@ -69,6 +89,7 @@ class TestMavenValidation:
         assert not validate_maven_path("/etc/passwd")
         assert not validate_maven_path("C:\\Windows\\System32")
         assert not validate_maven_path("path//with//double//slashes")
+        assert not validate_maven_path("org/foo/1.0/foo.jar\n")
 
 
 class TestSafeJoinPath:
@@ -81,4 +102,24 @@ class TestSafeJoinPath:
             safe_join_path(tmp_path, "..", "etc", "passwd")
         
         with pytest.raises(ValidationError):
-            safe_join_path(tmp_path, "npm", "..", "..", "etc")
\ No newline at end of file
+            safe_join_path(tmp_path, "npm", "..", "..", "etc")
+
+    def test_symlink_escape_blocked(self, tmp_path):
+        outside = tmp_path / "outside"
+        outside.mkdir()
+        base = tmp_path / "cache"
+        (base / "simple").mkdir(parents=True)
+        (base / "simple" / "evil").symlink_to(outside)
+        with pytest.raises(ValidationError):
+            safe_join_path(base, "simple", "evil", "index.html")
+
+    def test_symlink_inside_base_allowed(self, tmp_path):
+        (tmp_path / "real").mkdir()
+        (tmp_path / "link").symlink_to(tmp_path / "real")
+        result = safe_join_path(tmp_path, "link", "index.html")
+        assert result == tmp_path / "link" / "index.html"
+
+    def test_relative_base_gives_absolute_path(self):
+        result = safe_join_path(Path("cache"), "npm", "@types/react")
+        assert result.is_absolute()
+        assert result.parts[-3:] == ("npm", "@types", "react")